@@ -21,5 +21,13 @@ setup(
         'streamcorpus_pipeline.stages': [
             'opensextant = streamcorpus_opensextant.tagger:OpenSextantTagger',
         ],
+        'console_scripts': [
+            'streamcorpus_opensextant_gazetteer = streamcorpus_opensextant.gazetteer:main',
+            'streamcorpus_opensextant_standin = streamcorpus_opensextant.standin:main',
+            'streamcorpus_opensextant_benchmark = streamcorpus_opensextant.benchmark:main',
+            'streamcorpus_opensextant_microbench = streamcorpus_opensextant.microbench:main',
+            'streamcorpus_opensextant_captures = streamcorpus_opensextant.capture:main',
+            'streamcorpus_opensextant_geoindex = streamcorpus_opensextant.geoindex:main',
+        ],
     },
 )
@@ -0,0 +1,431 @@
+'''Record and replay OpenSextant responses through an indexed archive
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+An archive is a single file holding the response body for every
+distinct request the stage has made, keyed by a hash of the request
+method, URL path and body.  It plugs into the :mod:`requests`
+transport layer as a pair of adapters, so
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` runs
+exactly the same code in either mode:
+
+.. code-block:: yaml
+
+    opensextant:
+      archive_mode: record      # or replay
+      archive_path: /data/opensextant-responses.osra
+
+In ``record`` mode every successful response from the live service
+is appended to the archive, and the index is written when the stage
+shuts down or, since the pipeline does not shut down incremental
+transforms, when the process exits.  In ``replay`` mode no service
+is needed: responses are served from a memory map of the archive,
+and a request that is not in the archive fails like a connection
+error.
+
+The file is a header, a sequence of records (each with its own small
+header, so an archive whose recording was interrupted can still be
+read by scanning), then a sorted index of ``(key, offset, length)``
+entries and a footer pointing at the index.  Recording into an
+existing archive adds to it.
+
+All of the taggers in one process that record to the same
+``archive_path``, such as the threads of
+:mod:`streamcorpus_opensextant.benchmark`, share one writer through
+:func:`open_writer`.  A writer holds an exclusive lock on its file
+while it is open, so separate worker processes cannot record into the
+same archive; give each its own ``archive_path`` (for instance with
+the worker number in it) and record into one after another to combine
+them.
+
+.. autofunction:: open_writer
+.. autoclass:: ArchiveWriter
+.. autoclass:: ArchiveReader
+.. autoclass:: RecordingAdapter
+.. autoclass:: ReplayAdapter
+.. autofunction:: request_key
+
+'''
+from __future__ import absolute_import
+import atexit
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.exceptions import ConnectionError
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+MAGIC = b'OSRA'
+VERSION = 1
+
+# magic, version
+HEADER = struct.Struct('<4sI')
+# marker, key, payload length
+RECORD = struct.Struct('<4s20sQ')
+RECORD_MARKER = b'RCRD'
+# key, payload offset, payload length
+ENTRY = struct.Struct('<20sQQ')
+# marker, index offset, number of entries
+FOOTER = struct.Struct('<4sQQ')
+FOOTER_MARKER = b'OSRI'
+
+
+def request_key(method, url, body):
+    '''Compute the archive key for a request.
+
+    Only the path of `url` is used, so that an archive recorded
+    against one service host can be replayed for another.
+
+    :return: 20-byte binary digest
+
+    '''
+    if body is None:
+        body = b''
+    elif not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    digest = hashlib.sha1()
+    digest.update(method.upper().encode('ascii'))
+    digest.update(b'\n')
+    digest.update(urlparse(url).path.encode('utf-8'))
+    digest.update(b'\n')
+    digest.update(body)
+    return digest.digest()
+
+
+def _check_header(mm, path):
+    if len(mm) < HEADER.size or \
+            HEADER.unpack_from(mm, 0) != (MAGIC, VERSION):
+        raise ValueError('%s is not a version %d response archive'
+                         % (path, VERSION))
+
+
+def _footer(mm):
+    '''Get ``(index_offset, n_entries)`` from a complete archive.
+
+    Returns :const:`None` if the archive has no valid footer.
+
+    '''
+    if len(mm) < HEADER.size + FOOTER.size:
+        return None
+    marker, index_at, n_entries = FOOTER.unpack_from(
+        mm, len(mm) - FOOTER.size)
+    if marker != FOOTER_MARKER or \
+            index_at + n_entries * ENTRY.size + FOOTER.size != len(mm):
+        return None
+    return index_at, n_entries
+
+
+def _read_index(mm, path):
+    '''Get the index of an archive as a list of sorted entries.
+
+    Uses the footer if there is one, otherwise scans the records.
+    Returns the entries and the offset at which records end.
+
+    '''
+    _check_header(mm, path)
+    footer = _footer(mm)
+    if footer is not None:
+        index_at, n_entries = footer
+        entries = [ENTRY.unpack_from(mm, index_at + i * ENTRY.size)
+                   for i in range(n_entries)]
+        return entries, index_at
+
+    logger.warn('%s has no index, scanning records', path)
+    entries = {}
+    pos = HEADER.size
+    while pos + RECORD.size <= len(mm):
+        marker, key, length = RECORD.unpack_from(mm, pos)
+        if marker != RECORD_MARKER or \
+                pos + RECORD.size + length > len(mm):
+            break
+        entries[key] = (key, pos + RECORD.size, length)
+        pos += RECORD.size + length
+    return sorted(entries.values()), pos
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def open_writer(path):
+    '''Get the process-wide :class:`ArchiveWriter` for `path`.
+
+    Each call must be matched by a call to :meth:`ArchiveWriter.close`;
+    the index is written when the last user closes it, or when the
+    process exits if that comes first.
+
+    '''
+    key = os.path.realpath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = _writers[key] = ArchiveWriter(path)
+            writer._registry_key = key
+        else:
+            with writer._lock:
+                writer._users += 1
+        return writer
+
+
+class ArchiveWriter(object):
+    '''Append responses to an archive file.
+
+    This is safe to share between threads.  :meth:`close` must be
+    called to write the index, as it is at exit for writers from
+    :func:`open_writer`; an archive without one is still readable,
+    but opening it requires a scan.  Use :func:`open_writer`
+    rather than creating several writers for one file.
+
+    .. automethod:: __init__
+    .. automethod:: put
+    .. automethod:: close
+
+    '''
+
+    def __init__(self, path):
+        '''Open `path` for recording, adding to it if it exists.
+
+        :raise ValueError: if another writer has `path` open
+
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._users = 1
+        self._registry_key = None
+        self._fh = os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o666),
+                             'r+b')
+        if fcntl is not None:
+            try:
+                fcntl.flock(self._fh.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                self._fh.close()
+                self._fh = None
+                raise ValueError('%s is already being recorded by another '
+                                 'writer' % path)
+        try:
+            if os.fstat(self._fh.fileno()).st_size > 0:
+                mm = mmap.mmap(self._fh.fileno(), 0,
+                               access=mmap.ACCESS_READ)
+                try:
+                    entries, end = _read_index(mm, path)
+                finally:
+                    mm.close()
+                self._entries = dict((e[0], e) for e in entries)
+                self._fh.seek(end)
+                self._fh.truncate()
+            else:
+                self._fh.write(HEADER.pack(MAGIC, VERSION))
+        except Exception:
+            self._fh.close()
+            self._fh = None
+            raise
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def put(self, key, content):
+        '''Record `content` as the response for `key`.
+
+        Keys already in the archive are not written again.
+
+        '''
+        with self._lock:
+            if key in self._entries:
+                return
+            pos = self._fh.tell()
+            self._fh.write(RECORD.pack(RECORD_MARKER, key, len(content)))
+            self._fh.write(content)
+            self._entries[key] = (key, pos + RECORD.size, len(content))
+
+    def close(self):
+        '''Write the index and close the file.
+
+        A writer from :func:`open_writer` only does this when its last
+        user closes it.
+
+        '''
+        if self._registry_key is not None:
+            with _writers_lock:
+                with self._lock:
+                    self._users -= 1
+                    if self._users > 0:
+                        return
+                if _writers.get(self._registry_key) is self:
+                    del _writers[self._registry_key]
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            if self._fh is None:
+                return
+            index_at = self._fh.tell()
+            entries = sorted(self._entries.values())
+            self._fh.write(b''.join(ENTRY.pack(*e) for e in entries))
+            self._fh.write(FOOTER.pack(FOOTER_MARKER, index_at, len(entries)))
+            self._fh.close()
+            self._fh = None
+        logger.info('wrote %d responses to archive %s',
+                    len(entries), self.path)
+
+
+@atexit.register
+def _close_writers():
+    '''Write the index of every archive still being recorded.'''
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer._finish()
+
+
+class ArchiveReader(object):
+    '''Look up responses in a memory-mapped archive.
+
+    .. automethod:: __init__
+    .. automethod:: get
+    .. automethod:: close
+
+    '''
+
+    def __init__(self, path):
+        '''Open the archive at `path`.
+
+        :raise ValueError: if `path` is not a response archive
+
+        '''
+        self.path = path
+        self._fh = open(path, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            _check_header(self._mm, path)
+        except ValueError:
+            self.close()
+            raise
+        footer = _footer(self._mm)
+        if footer is not None:
+            self._index_at, self.n_entries = footer
+            self._entries = None
+        else:
+            # recording was interrupted; fall back to an in-memory
+            # index built by scanning the records
+            entries, _ = _read_index(self._mm, path)
+            self._entries = dict((e[0], e) for e in entries)
+            self.n_entries = len(entries)
+
+    def __len__(self):
+        return self.n_entries
+
+    def _lookup(self, key):
+        if self._entries is not None:
+            return self._entries.get(key)
+        lo, hi = 0, self.n_entries
+        while lo < hi:
+            mid = (lo + hi) // 2
+            entry = ENTRY.unpack_from(
+                self._mm, self._index_at + mid * ENTRY.size)
+            if entry[0] < key:
+                lo = mid + 1
+            elif entry[0] > key:
+                hi = mid
+            else:
+                return entry
+        return None
+
+    def get(self, key):
+        '''Get the response body for `key`, or :const:`None`.'''
+        entry = self._lookup(key)
+        if entry is None:
+            return None
+        _, offset, length = entry
+        return self._mm[offset:offset + length]
+
+    def close(self):
+        '''Release the memory map.'''
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class RecordingAdapter(BaseAdapter):
+    '''Transport adapter that records successful responses.
+
+    Requests are sent through `adapter`, a plain
+    :class:`requests.adapters.HTTPAdapter` by default.
+
+    '''
+
+    def __init__(self, archive, adapter=None):
+        super(RecordingAdapter, self).__init__()
+        self.archive = archive
+        self.adapter = adapter if adapter is not None else HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        response = self.adapter.send(request, **kwargs)
+        if response.status_code == 200:
+            self.archive.put(
+                request_key(request.method, request.url, request.body),
+                response.content)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    '''Transport adapter that serves responses from an archive.
+
+    :raise requests.exceptions.ConnectionError: from :meth:`send` if
+      the request is not in the archive
+
+    '''
+
+    def __init__(self, archive):
+        super(ReplayAdapter, self).__init__()
+        self.archive = archive
+
+    def send(self, request, stream=False, timeout=None, verify=True,
+             cert=None, proxies=None):
+        content = self.archive.get(
+            request_key(request.method, request.url, request.body))
+        if content is None:
+            raise ConnectionError('no archived response for %s %s'
+                                  % (request.method, request.url),
+                                  request=request)
+        response = Response()
+        response.status_code = 200
+        response.reason = 'OK'
+        response.headers = CaseInsensitiveDict({
+            'content-type': 'application/json',
+            'content-length': str(len(content)),
+        })
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response._content = content
+        response.connection = self
+        return response
+
+    def close(self):
+        pass
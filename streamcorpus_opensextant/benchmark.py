@@ -0,0 +1,252 @@
+'''End-to-end throughput and latency benchmark for the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Runs :class:`~streamcorpus_opensextant.tagger.OpenSextantTagger`
+against a :class:`~streamcorpus_opensextant.standin.StandinServer`
+on a synthetic corpus (see :mod:`streamcorpus_opensextant.synthetic`),
+sweeping the number of concurrent workers, the document kind, and
+which of ``annotate_sentences`` and ``add_geo_selectors`` are on.
+Each configuration reports documents and megabytes per second,
+p50/p95/p99 per-item latency and peak RSS, and the whole sweep is
+written as JSON so runs of different releases can be compared:
+
+.. code-block:: bash
+
+    streamcorpus_opensextant_benchmark --concurrency 1,4,16 \\
+        --kinds tweet,news,page --docs 200 --latency lognormal:-4:0.5 \\
+        --output bench-$(git describe).json
+
+Pass ``--network-address`` to benchmark a real OpenSextant service
+instead of the stand-in.
+
+Tokenization for ``annotate_sentences`` happens before the clock
+starts.  Peak RSS is the high-water mark of the whole benchmark
+process, so it only grows across a sweep; order the sweep from small
+to large documents, as the defaults do, to attribute it.
+
+.. autofunction:: run_benchmark
+.. autofunction:: sweep
+
+'''
+from __future__ import absolute_import
+import argparse
+from copy import deepcopy
+import itertools
+import json
+import logging
+import math
+import platform
+import resource
+import sys
+import threading
+import time
+
+from streamcorpus_opensextant.standin import StandinServer
+from streamcorpus_opensextant.synthetic import document_sizes, make_corpus
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+clock = getattr(time, 'monotonic', time.time)
+
+#: (annotate_sentences, add_geo_selectors) configurations to sweep
+default_modes = [(False, True), (True, False), (True, True)]
+
+
+def percentile(values, pct):
+    '''Nearest-rank percentile of sorted `values`.'''
+    if not values:
+        return None
+    rank = int(math.ceil(pct / 100.0 * len(values))) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+def peak_rss_kb():
+    '''Peak resident set size of this process in kilobytes.'''
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        peak //= 1024
+    return peak
+
+
+def run_benchmark(network_address, kind, docs, concurrency,
+                  annotate_sentences, add_geo_selectors, config=None,
+                  seed=0):
+    '''Tag `docs` synthetic documents of `kind` and measure it.
+
+    `concurrency` threads each run their own tagger, as separate
+    pipeline workers would, pulling from a shared list of items.
+
+    :param str network_address: ``host:port`` of the service
+    :param dict config: extra tagger configuration
+    :return: dictionary of measurements
+
+    '''
+    items = make_corpus(kind, docs, seed=seed)
+    if annotate_sentences:
+        from streamcorpus_pipeline._tokenizer import nltk_tokenizer
+        tokenizer = nltk_tokenizer({})
+        for si in items:
+            tokenizer.process_item(si)
+
+    tagger_config = deepcopy(OpenSextantTagger.default_config)
+    tagger_config.update(config or {})
+    tagger_config['network_address'] = network_address
+    tagger_config['annotate_sentences'] = annotate_sentences
+    tagger_config['add_geo_selectors'] = add_geo_selectors
+
+    latencies = []
+    failures = [0]
+    lock = threading.Lock()
+    pending = list(reversed(items))
+
+    def work():
+        tagger = OpenSextantTagger(tagger_config)
+        while True:
+            with lock:
+                if not pending:
+                    break
+                si = pending.pop()
+            start = clock()
+            try:
+                tagger.process_item(si)
+                failed = False
+            except Exception:
+                logger.debug('benchmark item failed', exc_info=True)
+                failed = True
+            elapsed = clock() - start
+            with lock:
+                latencies.append(elapsed)
+                failures[0] += failed
+        tagger.shutdown()
+
+    threads = [threading.Thread(target=work) for _ in range(concurrency)]
+    start = clock()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = clock() - start
+
+    n_bytes = sum(len(si.body.clean_visible) for si in items)
+    latencies.sort()
+    return {
+        'kind': kind,
+        'docs': docs,
+        'concurrency': concurrency,
+        'annotate_sentences': annotate_sentences,
+        'add_geo_selectors': add_geo_selectors,
+        'bytes': n_bytes,
+        'failures': failures[0],
+        'elapsed_sec': elapsed,
+        'docs_per_sec': docs / elapsed if elapsed else None,
+        'mb_per_sec': n_bytes / (1024.0 * 1024.0) / elapsed
+        if elapsed else None,
+        'latency_p50_sec': percentile(latencies, 50),
+        'latency_p95_sec': percentile(latencies, 95),
+        'latency_p99_sec': percentile(latencies, 99),
+        'latency_max_sec': latencies[-1] if latencies else None,
+        'peak_rss_kb': peak_rss_kb(),
+    }
+
+
+def sweep(network_address, kinds, docs, concurrencies, modes=None,
+          config=None):
+    '''Run :func:`run_benchmark` over every combination of parameters.
+
+    :param list kinds: document kinds, outermost loop
+    :param docs: number of documents per run, or a dictionary of
+      that keyed by kind
+    :param list concurrencies: worker thread counts
+    :param list modes: ``(annotate_sentences, add_geo_selectors)``
+      pairs, :data:`default_modes` by default
+    :return: list of result dictionaries
+
+    '''
+    results = []
+    for kind, concurrency, (annotate, geo) in itertools.product(
+            kinds, concurrencies, modes or default_modes):
+        n_docs = docs[kind] if isinstance(docs, dict) else docs
+        result = run_benchmark(network_address, kind, n_docs, concurrency,
+                               annotate, geo, config=config)
+        logger.info('%(kind)s x%(docs)d concurrency=%(concurrency)d '
+                    'annotate_sentences=%(annotate_sentences)s '
+                    'add_geo_selectors=%(add_geo_selectors)s: '
+                    '%(docs_per_sec).1f docs/s %(mb_per_sec).2f MB/s '
+                    'p99=%(latency_p99_sec).3fs', result)
+        results.append(result)
+    return results
+
+
+def main():
+    '''Run a benchmark sweep and write the results as JSON.'''
+    parser = argparse.ArgumentParser(
+        description='benchmark the opensextant stage end to end')
+    parser.add_argument('--concurrency', default='1,4,16',
+                        help='comma-separated worker thread counts')
+    parser.add_argument('--kinds', default='tweet,news,page',
+                        help='comma-separated document kinds: %s'
+                        % ', '.join(sorted(document_sizes)))
+    parser.add_argument('--docs', type=int, default=100,
+                        help='documents per run (page runs use a tenth)')
+    parser.add_argument('--modes', default='geo,general,both',
+                        help='comma-separated subset of geo (selectors '
+                        'only), general (sentences only) and both')
+    parser.add_argument('--network-address',
+                        help='benchmark this service instead of a stand-in')
+    parser.add_argument('--latency', help='stand-in latency spec, see '
+                        'streamcorpus_opensextant.standin.make_latency')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int)
+    parser.add_argument('--output', help='write JSON results here '
+                        'instead of stdout')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    mode_names = {'geo': (False, True), 'general': (True, False),
+                  'both': (True, True)}
+    modes = [mode_names[m] for m in args.modes.split(',')]
+    kinds = args.kinds.split(',')
+    docs = dict((kind, max(1, args.docs // 10) if kind == 'page'
+                 else args.docs) for kind in kinds)
+    concurrencies = [int(c) for c in args.concurrency.split(',')]
+
+    server = None
+    network_address = args.network_address
+    if network_address is None:
+        server = StandinServer(latency=args.latency,
+                               error_rate=args.error_rate,
+                               max_concurrency=args.max_concurrency,
+                               seed=0).start()
+        network_address = server.network_address
+    try:
+        results = sweep(network_address, kinds, docs, concurrencies, modes)
+    finally:
+        if server is not None:
+            server.stop()
+
+    report = {
+        'benchmark': 'streamcorpus_opensextant.benchmark',
+        'time': time.time(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'service': 'standin' if server is not None else network_address,
+        'standin': {
+            'latency': args.latency,
+            'error_rate': args.error_rate,
+            'max_concurrency': args.max_concurrency,
+        } if server is not None else None,
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
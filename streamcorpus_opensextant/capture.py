@@ -0,0 +1,239 @@
+'''Capture slow documents for offline reproduction
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Latency outliers are usually caused by particular documents, and by
+the time anyone looks the input is gone.  With ``capture_dir`` set,
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` saves any
+item whose request (to the service or the gazetteer) takes longer
+than ``capture_request_seconds``, or whose processing after the
+request takes longer than ``capture_processing_seconds``:
+
+.. code-block:: yaml
+
+    opensextant:
+      capture_dir: /var/spool/opensextant-slow
+      capture_request_seconds: 10
+      capture_processing_seconds: 2
+      capture_max_bytes: 1073741824
+
+Each capture is a directory named after the stream_id holding
+``clean_visible``, the raw ``response`` (absent if the request
+failed) and ``capture.json`` with the per-phase timings (see
+:mod:`streamcorpus_opensextant.profiling`), the service URL and the
+time of capture.  When the spool grows beyond ``capture_max_bytes``
+the oldest captures are deleted.
+
+Capture directories can be given directly to
+:mod:`streamcorpus_opensextant.microbench`, and
+:func:`archive_captures` (also available as
+``streamcorpus_opensextant_captures``) loads them into a response
+archive for replay (see :mod:`streamcorpus_opensextant.archive`).
+
+.. autoclass:: SlowCapture
+.. autofunction:: load_capture
+.. autofunction:: archive_captures
+
+'''
+from __future__ import absolute_import
+import argparse
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+CLEAN_VISIBLE = 'clean_visible'
+RESPONSE = 'response'
+METADATA = 'capture.json'
+
+
+def _dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name))
+               for name in os.listdir(path))
+
+
+class SlowCapture(object):
+    '''Size-capped spool of slow stream items.
+
+    .. automethod:: __init__
+    .. automethod:: check
+    .. automethod:: save
+
+    '''
+
+    def __init__(self, spool_dir, request_seconds=10.0,
+                 processing_seconds=2.0, max_bytes=1 << 30):
+        '''Open (creating if needed) the spool in `spool_dir`.
+
+        :param float request_seconds: capture items whose request
+          takes longer than this
+        :param float processing_seconds: capture items whose
+          processing after the request takes longer than this
+        :param int max_bytes: most bytes to keep in the spool
+
+        '''
+        self.spool_dir = spool_dir
+        self.request_seconds = float(request_seconds)
+        self.processing_seconds = float(processing_seconds)
+        self.max_bytes = int(max_bytes)
+        if not os.path.isdir(spool_dir):
+            os.makedirs(spool_dir)
+        # (mtime, name, size) of existing captures, oldest first
+        self._captures = []
+        for name in os.listdir(spool_dir):
+            path = os.path.join(spool_dir, name)
+            if os.path.isdir(path):
+                self._captures.append(
+                    (os.path.getmtime(path), name, _dir_size(path)))
+        self._captures.sort()
+        self.bytes = sum(size for _, _, size in self._captures)
+        self.captured = 0
+
+    def check(self, si, timings, response, url=None):
+        '''Save `si` if `timings` are over the thresholds.
+
+        :param si: stream item that was processed
+        :param dict timings: phase durations, with ``total``
+        :param bytes response: raw response, or :const:`None`
+        :param str url: service URL the item was sent to
+        :return: :const:`True` if `si` was captured
+
+        '''
+        request = timings.get('request', 0.0) + timings.get('gazetteer', 0.0)
+        processing = (timings.get('total') or 0.0) - request
+        if request <= self.request_seconds and \
+                processing <= self.processing_seconds:
+            return False
+        logger.info('capturing slow item %s: request %.3fs, '
+                    'processing %.3fs', si.stream_id, request, processing)
+        return self.save(si, timings, response, url)
+
+    def save(self, si, timings, response, url=None):
+        '''Write a capture of `si` into the spool.
+
+        Errors writing the spool are logged, not raised, so that a
+        full or shared spool never fails the item.
+
+        '''
+        name = re.sub(r'[^\w.-]', '_', si.stream_id or 'unknown')
+        size = len(si.body.clean_visible) + len(response or b'')
+        if size > self.max_bytes:
+            logger.warn('not capturing %s: %d bytes is more than '
+                        'capture_max_bytes', si.stream_id, size)
+            return False
+        path = os.path.join(self.spool_dir, name)
+        try:
+            return self._write(si, timings, response, url, name, path)
+        except (IOError, OSError):
+            logger.warn('could not capture %s to %s', si.stream_id, path,
+                        exc_info=True)
+            shutil.rmtree(path + '.tmp', ignore_errors=True)
+            return False
+
+    def _write(self, si, timings, response, url, name, path):
+        self._remove(name)
+        tmp = path + '.tmp'
+        if os.path.exists(tmp):
+            shutil.rmtree(tmp)
+        os.makedirs(tmp)
+        with open(os.path.join(tmp, CLEAN_VISIBLE), 'wb') as fh:
+            fh.write(si.body.clean_visible)
+        if response is not None:
+            with open(os.path.join(tmp, RESPONSE), 'wb') as fh:
+                fh.write(response)
+        with open(os.path.join(tmp, METADATA), 'w') as fh:
+            json.dump({
+                'stream_id': si.stream_id,
+                'url': url,
+                'time': time.time(),
+                'timings': timings,
+            }, fh, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+        size = _dir_size(path)
+        self._captures.append((os.path.getmtime(path), name, size))
+        self.bytes += size
+        self.captured += 1
+        while self.bytes > self.max_bytes and self._captures:
+            self._remove(self._captures[0][1])
+        return True
+
+    def _remove(self, name):
+        for i, (_, other, size) in enumerate(self._captures):
+            if other == name:
+                del self._captures[i]
+                self.bytes -= size
+                shutil.rmtree(os.path.join(self.spool_dir, name),
+                              ignore_errors=True)
+                return
+
+
+def load_capture(path):
+    '''Load one capture directory.
+
+    :return: ``(metadata, clean_visible, response)``, with `response`
+      :const:`None` if the request failed
+
+    '''
+    with open(os.path.join(path, METADATA)) as fh:
+        metadata = json.load(fh)
+    with open(os.path.join(path, CLEAN_VISIBLE), 'rb') as fh:
+        clean_visible = fh.read()
+    response = None
+    if os.path.exists(os.path.join(path, RESPONSE)):
+        with open(os.path.join(path, RESPONSE), 'rb') as fh:
+            response = fh.read()
+    return metadata, clean_visible, response
+
+
+def iter_captures(spool_dir):
+    '''Yield the paths of the capture directories in `spool_dir`.'''
+    for name in sorted(os.listdir(spool_dir)):
+        path = os.path.join(spool_dir, name)
+        if os.path.exists(os.path.join(path, METADATA)):
+            yield path
+
+
+def archive_captures(spool_dir, archive_path):
+    '''Add the responses of all captures in `spool_dir` to an archive.
+
+    Captures without a response are skipped.
+
+    :return: number of responses archived
+
+    '''
+    from streamcorpus_opensextant.archive import ArchiveWriter, request_key
+    writer = ArchiveWriter(archive_path)
+    count = 0
+    try:
+        for path in iter_captures(spool_dir):
+            metadata, clean_visible, response = load_capture(path)
+            if response is None or not metadata.get('url'):
+                continue
+            writer.put(request_key('POST', metadata['url'], clean_visible),
+                       response)
+            count += 1
+    finally:
+        writer.close()
+    return count
+
+
+def main():
+    '''Load captured slow documents into a response archive.'''
+    parser = argparse.ArgumentParser(
+        description='add the responses captured in a slow-document spool '
+        'to a response archive for replay')
+    parser.add_argument('spool_dir')
+    parser.add_argument('archive')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    count = archive_captures(args.spool_dir, args.archive)
+    logger.info('archived %d captured responses', count)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,338 @@
+'''In-process gazetteer tagger for geo-only OpenSextant runs
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+When :class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` is
+configured with ``annotate_sentences: false`` it only wants PLACE
+annotations, and a full round trip through the OpenSextant service
+is expensive for that.  This module matches a gazetteer of place
+names directly against ``clean_visible`` and produces results in
+the same shape as the service's ``annoList``, so that
+:meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.filter`
+and
+:meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.get_geo_selectors`
+work on them unchanged.
+
+The gazetteer source is a UTF-8 tab-separated file with one place
+per line::
+
+    name <TAB> placeID <TAB> latitude <TAB> longitude <TAB> nameBias
+
+Blank lines and lines starting with ``#`` are ignored.  It is
+compiled into a compact character trie stored in a single binary
+index file, which :class:`Gazetteer` memory-maps, so opening even a
+very large gazetteer costs almost nothing and the pages are shared
+between worker processes.  Build an index with:
+
+.. code-block:: bash
+
+    streamcorpus_opensextant_gazetteer places.tsv places.idx
+
+and point the stage at it:
+
+.. code-block:: yaml
+
+    opensextant:
+      annotate_sentences: false
+      add_geo_selectors: true
+      gazetteer_path: /data/places.idx
+      gazetteer_mode: fallback
+
+With ``gazetteer_mode: primary`` the service is never contacted;
+with ``fallback`` (the default) the gazetteer is only used when the
+request to the service fails.
+
+Matching is case-insensitive and only accepts matches that start
+and end on word boundaries.  Overlapping candidates are resolved
+leftmost-longest, and when several places share a name the one with
+the highest ``nameBias`` wins.
+
+.. autoclass:: Gazetteer
+.. autofunction:: write_index
+.. autofunction:: read_tsv
+
+'''
+from __future__ import absolute_import
+import argparse
+import codecs
+import logging
+import mmap
+import re
+import struct
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+MAGIC = b'OSGZ'
+VERSION = 1
+
+# magic, version, n_nodes, n_edges, n_places, n_string_bytes
+HEADER = struct.Struct('<4sIIIII')
+# edge_start, edge_count, place_start, place_count
+NODE = struct.Struct('<IIII')
+# codepoint, child node
+EDGE = struct.Struct('<II')
+# latitude, longitude, nameBias, name_off, name_len, pid_off, pid_len
+PLACE = struct.Struct('<dddIIII')
+
+word_re = re.compile(r'\w+', re.UNICODE)
+
+
+def normalize(text):
+    '''Case-fold `text` without changing its length.
+
+    Offsets into the normalized string must be valid offsets into
+    the original, so characters whose lowercase form is longer than
+    one character are left alone.
+
+    '''
+    lowered = text.lower()
+    if len(lowered) == len(text):
+        return lowered
+    return u''.join(c.lower() if len(c.lower()) == 1 else c for c in text)
+
+
+def read_tsv(path):
+    '''Read gazetteer rows from a tab-separated file.
+
+    Yields tuples of ``(name, place_id, latitude, longitude,
+    name_bias)`` with `name` and `place_id` as :class:`unicode`.
+
+    '''
+    with codecs.open(path, 'r', encoding='utf-8') as fh:
+        for lineno, line in enumerate(fh, 1):
+            line = line.rstrip(u'\r\n')
+            if not line.strip() or line.startswith(u'#'):
+                continue
+            parts = line.split(u'\t')
+            if len(parts) != 5:
+                raise ValueError('%s:%d: expected 5 tab-separated fields, '
+                                 'got %d' % (path, lineno, len(parts)))
+            name, pid, lat, lng, bias = parts
+            yield (name, pid, float(lat), float(lng), float(bias))
+
+
+def write_index(rows, path):
+    '''Compile gazetteer `rows` into an index file at `path`.
+
+    `rows` is an iterable of ``(name, place_id, latitude, longitude,
+    name_bias)`` tuples, such as produced by :func:`read_tsv`.
+
+    '''
+    # build a dictionary trie in memory, then lay it out breadth
+    # first so that every node's edges are contiguous
+    children = [{}]
+    places = [[]]
+    for name, pid, lat, lng, bias in rows:
+        key = normalize(name.strip())
+        if not key:
+            continue
+        node = 0
+        for c in key:
+            child = children[node].get(ord(c))
+            if child is None:
+                child = len(children)
+                children[node][ord(c)] = child
+                children.append({})
+                places.append([])
+            node = child
+        places[node].append((name, pid, lat, lng, bias))
+
+    order = [0]
+    for node in order:
+        order.extend(children[node][cp] for cp in sorted(children[node]))
+    position = dict((node, pos) for pos, node in enumerate(order))
+
+    strings = []
+    n_string_bytes = [0]
+
+    def intern(s):
+        data = s.encode('utf-8')
+        offset = n_string_bytes[0]
+        strings.append(data)
+        n_string_bytes[0] += len(data)
+        return offset, len(data)
+
+    node_recs = []
+    edge_recs = []
+    place_recs = []
+    for node in order:
+        edges = sorted(children[node].items())
+        node_places = sorted(places[node], key=lambda p: -p[4])
+        node_recs.append(NODE.pack(len(edge_recs), len(edges),
+                                   len(place_recs), len(node_places)))
+        for cp, child in edges:
+            edge_recs.append(EDGE.pack(cp, position[child]))
+        for name, pid, lat, lng, bias in node_places:
+            name_off, name_len = intern(name)
+            pid_off, pid_len = intern(pid)
+            place_recs.append(PLACE.pack(lat, lng, bias, name_off, name_len,
+                                         pid_off, pid_len))
+
+    with open(path, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, len(node_recs), len(edge_recs),
+                             len(place_recs), n_string_bytes[0]))
+        for recs in (node_recs, edge_recs, place_recs, strings):
+            fh.write(b''.join(recs))
+    logger.info('wrote gazetteer index %s: %d places, %d trie nodes',
+                path, len(place_recs), len(node_recs))
+
+
+class Gazetteer(object):
+    '''Memory-mapped gazetteer index.
+
+    Opening an index only maps the file; pages are read on demand as
+    :meth:`find` walks the trie.
+
+    .. automethod:: __init__
+    .. automethod:: find
+    .. automethod:: extract
+    .. automethod:: close
+
+    '''
+
+    def __init__(self, path):
+        '''Open the gazetteer index file at `path`.
+
+        :raise ValueError: if `path` is not a gazetteer index
+
+        '''
+        self.path = path
+        self._fh = open(path, 'rb')
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_nodes, n_edges, n_places, n_string_bytes = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d gazetteer index'
+                             % (path, VERSION))
+        self._nodes_at = HEADER.size
+        self._edges_at = self._nodes_at + n_nodes * NODE.size
+        self._places_at = self._edges_at + n_edges * EDGE.size
+        self._strings_at = self._places_at + n_places * PLACE.size
+        self.n_places = n_places
+
+        # the root fans out to every initial character; it is
+        # consulted at every word start, so keep it as a dict
+        edge_start, edge_count, _, _ = self._node(0)
+        self._root = dict(
+            EDGE.unpack_from(self._mm, self._edges_at + i * EDGE.size)
+            for i in range(edge_start, edge_start + edge_count))
+
+    def close(self):
+        '''Release the memory map.'''
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _node(self, node):
+        return NODE.unpack_from(self._mm, self._nodes_at + node * NODE.size)
+
+    def _child(self, node, cp):
+        if node == 0:
+            return self._root.get(cp)
+        edge_start, edge_count, _, _ = self._node(node)
+        lo, hi = edge_start, edge_start + edge_count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            mid_cp, child = EDGE.unpack_from(
+                self._mm, self._edges_at + mid * EDGE.size)
+            if mid_cp < cp:
+                lo = mid + 1
+            elif mid_cp > cp:
+                hi = mid
+            else:
+                return child
+        return None
+
+    def _string(self, offset, length):
+        start = self._strings_at + offset
+        return self._mm[start:start + length].decode('utf-8')
+
+    def _place(self, index):
+        lat, lng, bias, name_off, name_len, pid_off, pid_len = \
+            PLACE.unpack_from(self._mm, self._places_at + index * PLACE.size)
+        return {
+            'placeName': self._string(name_off, name_len),
+            'placeID': self._string(pid_off, pid_len),
+            'latitude': lat,
+            'longitude': lng,
+            'nameBias': bias,
+        }
+
+    def find(self, text):
+        '''Find gazetteer places in :class:`unicode` `text`.
+
+        Yields ``(start, end, place)`` for each non-overlapping
+        match, in document order, where `place` is a dictionary shaped
+        like the ``place`` feature of an OpenSextant PLACE annotation.
+
+        '''
+        folded = normalize(text)
+        n = len(folded)
+        resume = 0
+        for word in word_re.finditer(folded):
+            start = word.start()
+            if start < resume:
+                continue
+            node = 0
+            best = None
+            pos = start
+            while pos < n:
+                node = self._child(node, ord(folded[pos]))
+                if node is None:
+                    break
+                pos += 1
+                if pos < n and folded[pos].isalnum():
+                    continue
+                _, _, place_start, place_count = self._node(node)
+                if place_count:
+                    best = (pos, place_start)
+            if best is not None:
+                end, place_index = best
+                resume = end
+                yield start, end, self._place(place_index)
+
+    def extract(self, text):
+        '''Tag `text` and return results like the OpenSextant service.
+
+        The return value is a dictionary with an ``annoList`` of
+        PLACE annotations, suitable for passing to
+        :meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.filter`
+        and
+        :meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.get_geo_selectors`.
+
+        '''
+        anno_list = []
+        for start, end, place in self.find(text):
+            anno_list.append({
+                'start': start,
+                'end': end,
+                'type': 'PLACE',
+                'matchText': text[start:end],
+                'features': {
+                    'hierarchy': 'Geo.place.namedPlace',
+                    'place': place,
+                },
+            })
+        return {'annoList': anno_list}
+
+
+def main():
+    '''Build a gazetteer index from a tab-separated file.'''
+    parser = argparse.ArgumentParser(
+        description='compile a tab-separated gazetteer of '
+        '(name, placeID, latitude, longitude, nameBias) into an index '
+        'for the opensextant stage')
+    parser.add_argument('input', help='tab-separated gazetteer file')
+    parser.add_argument('output', help='path to write the index')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    write_index(read_tsv(args.input), args.output)
+
+
+if __name__ == '__main__':
+    main()
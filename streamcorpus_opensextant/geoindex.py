@@ -0,0 +1,492 @@
+'''Geospatial side-index of the places found by the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Finding the documents that mention places near a point otherwise
+means reading every chunk and decoding every ``GEOJSON`` selector.
+With ``geo_index_dir`` set,
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` also
+writes, for each input chunk, a small index file of every PLACE
+annotation it keeps, named after the chunk with a short hash of its
+full path and a ``.geoidx`` suffix (see :func:`chunk_index_name`):
+
+.. code-block:: yaml
+
+    opensextant:
+      geo_index_dir: /data/geoidx
+
+Each entry maps a 64-bit Z-order key (the bits of a geohash:
+longitude and latitude quantized to 32 bits each and interleaved,
+longitude first) to the stream_id, placeID and character offset and
+length of the mention.  Entries are fixed-size and sorted by key, so
+:class:`GeoIndex` answers :meth:`~GeoIndex.bbox` and
+:meth:`~GeoIndex.radius` queries by covering the region with a few
+key ranges and binary-searching a memory map of the file, touching
+only the pages that hold matches.  :func:`merge` combines per-chunk
+indexes into a corpus-level one.  From the shell:
+
+.. code-block:: bash
+
+    streamcorpus_opensextant_geoindex merge corpus.geoidx chunks/*.geoidx
+    streamcorpus_opensextant_geoindex query corpus.geoidx --radius 48.86,2.35,25
+
+.. autoclass:: GeoIndex
+.. autoclass:: GeoIndexWriter
+.. autofunction:: write_index
+.. autofunction:: merge
+.. autofunction:: encode
+.. autofunction:: decode
+.. autofunction:: chunk_index_name
+
+'''
+from __future__ import absolute_import
+import argparse
+import atexit
+from collections import namedtuple
+import hashlib
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import struct
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+MAGIC = b'OSGI'
+VERSION = 1
+
+# magic, version, n_records, n_strings, n_string_bytes
+HEADER = struct.Struct('<4sIQQQ')
+# key, stream_id string, placeID string, offset, length
+RECORD = struct.Struct('<QIIII')
+# string offset, string length
+STRING = struct.Struct('<II')
+
+EARTH_RADIUS_KM = 6371.0088
+
+#: one place mention found by a query
+Hit = namedtuple('Hit', 'stream_id place_id latitude longitude '
+                 'offset length')
+
+_scale = float(1 << 32)
+
+
+def _spread(v):
+    '''Spread the 32 bits of `v` into the even bits of a 64-bit value.'''
+    v &= 0xFFFFFFFF
+    v = (v | (v << 16)) & 0x0000FFFF0000FFFF
+    v = (v | (v << 8)) & 0x00FF00FF00FF00FF
+    v = (v | (v << 4)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v << 2)) & 0x3333333333333333
+    v = (v | (v << 1)) & 0x5555555555555555
+    return v
+
+
+def _compact(v):
+    '''Inverse of :func:`_spread`.'''
+    v &= 0x5555555555555555
+    v = (v | (v >> 1)) & 0x3333333333333333
+    v = (v | (v >> 2)) & 0x0F0F0F0F0F0F0F0F
+    v = (v | (v >> 4)) & 0x00FF00FF00FF00FF
+    v = (v | (v >> 8)) & 0x0000FFFF0000FFFF
+    v = (v | (v >> 16)) & 0x00000000FFFFFFFF
+    return v
+
+
+def _quantize(value, low, span):
+    q = int((value - low) / span * _scale)
+    return min(max(q, 0), (1 << 32) - 1)
+
+
+def encode(lat, lng):
+    '''Get the 64-bit Z-order key of a point.'''
+    return (_spread(_quantize(lng, -180.0, 360.0)) << 1) | \
+        _spread(_quantize(lat, -90.0, 180.0))
+
+
+def decode(key):
+    '''Get the ``(lat, lng)`` at the center of the cell of `key`.'''
+    lng_q = _compact(key >> 1)
+    lat_q = _compact(key)
+    return ((lat_q + 0.5) / _scale * 180.0 - 90.0,
+            (lng_q + 0.5) / _scale * 360.0 - 180.0)
+
+
+def _cover(min_lat, min_lng, max_lat, max_lng, max_ranges=32):
+    '''Cover a box with at most about `max_ranges` key ranges.
+
+    Returns sorted, merged inclusive ``(low, high)`` key ranges whose
+    cells together contain the box.
+
+    '''
+    done = []
+    # (key prefix, bits in prefix, lat0, lat1, lng0, lng1)
+    partial = [(0, 0, -90.0, 90.0, -180.0, 180.0)]
+    while partial:
+        if len(done) + 2 * len(partial) > max_ranges or partial[0][1] == 64:
+            done.extend(partial)
+            break
+        split = []
+        for prefix, bits, lat0, lat1, lng0, lng1 in partial:
+            if bits % 2 == 0:
+                mid = (lng0 + lng1) / 2
+                halves = [(lat0, lat1, lng0, mid), (lat0, lat1, mid, lng1)]
+            else:
+                mid = (lat0 + lat1) / 2
+                halves = [(lat0, mid, lng0, lng1), (mid, lat1, lng0, lng1)]
+            for bit, (a0, a1, b0, b1) in enumerate(halves):
+                if a1 < min_lat or a0 > max_lat or \
+                        b1 < min_lng or b0 > max_lng:
+                    continue
+                cell = ((prefix << 1) | bit, bits + 1, a0, a1, b0, b1)
+                if a0 >= min_lat and a1 <= max_lat and \
+                        b0 >= min_lng and b1 <= max_lng:
+                    done.append(cell)
+                else:
+                    split.append(cell)
+        partial = split
+
+    cells = []
+    for prefix, bits, _, _, _, _ in done:
+        shift = 64 - bits
+        cells.append((prefix << shift, (prefix << shift) | ((1 << shift) - 1)))
+    ranges = []
+    for low, high in sorted(cells):
+        if ranges and ranges[-1][1] + 1 >= low:
+            ranges[-1] = (ranges[-1][0], max(ranges[-1][1], high))
+        else:
+            ranges.append((low, high))
+    return ranges
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    '''Great-circle distance between two points in kilometers.'''
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + \
+        math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def write_index(records, path):
+    '''Write an index file from `records` sorted by key.
+
+    `records` is an iterable of ``(key, stream_id, place_id, offset,
+    length)``.  Records are streamed to disk; only the distinct
+    strings are held in memory.
+
+    :return: number of records written
+
+    '''
+    strings = {}
+    string_list = []
+    n_records = 0
+    last_key = -1
+
+    def intern(s):
+        index = strings.get(s)
+        if index is None:
+            index = strings[s] = len(string_list)
+            string_list.append(s.encode('utf-8') if not isinstance(s, bytes)
+                               else s)
+        return index
+
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as fh:
+        fh.write(HEADER.pack(MAGIC, VERSION, 0, 0, 0))
+        for key, stream_id, place_id, offset, length in records:
+            if key < last_key:
+                raise ValueError('records are not sorted by key')
+            last_key = key
+            fh.write(RECORD.pack(key, intern(stream_id), intern(place_id),
+                                 offset, length))
+            n_records += 1
+        pos = 0
+        for data in string_list:
+            fh.write(STRING.pack(pos, len(data)))
+            pos += len(data)
+        for data in string_list:
+            fh.write(data)
+        fh.seek(0)
+        fh.write(HEADER.pack(MAGIC, VERSION, n_records, len(string_list),
+                             pos))
+    os.rename(tmp, path)
+    return n_records
+
+
+class GeoIndexWriter(object):
+    '''Collect place mentions and write them as one index file.
+
+    .. automethod:: add
+    .. automethod:: close
+
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.records = []
+
+    def add(self, stream_id, place_id, lat, lng, offset, length):
+        '''Add one place mention.'''
+        self.records.append((encode(lat, lng), stream_id, place_id,
+                             offset, length))
+
+    def close(self):
+        '''Sort and write the mentions; returns the number written.'''
+        self.records.sort()
+        count = write_index(self.records, self.path)
+        self.records = []
+        return count
+
+
+class GeoIndex(object):
+    '''Query a memory-mapped index file.
+
+    .. automethod:: __init__
+    .. automethod:: bbox
+    .. automethod:: radius
+    .. automethod:: close
+
+    '''
+
+    def __init__(self, path):
+        '''Open the index at `path`.
+
+        :raise ValueError: if `path` is not a geo index
+
+        '''
+        self.path = path
+        self._fh = open(path, 'rb')
+        size = os.fstat(self._fh.fileno()).st_size
+        if size < HEADER.size:
+            self._mm = None
+            self.close()
+            raise ValueError('%s is not a version %d geo index'
+                             % (path, VERSION))
+        self._mm = mmap.mmap(self._fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, self.n_records, self.n_strings, _ = \
+            HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError('%s is not a version %d geo index'
+                             % (path, VERSION))
+        self._records_at = HEADER.size
+        self._strings_at = self._records_at + self.n_records * RECORD.size
+        self._pool_at = self._strings_at + self.n_strings * STRING.size
+
+    def __len__(self):
+        return self.n_records
+
+    def close(self):
+        '''Release the memory map.'''
+        if self._mm is not None:
+            self._mm.close()
+            self._mm = None
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+    def _key(self, i):
+        return struct.unpack_from(
+            '<Q', self._mm, self._records_at + i * RECORD.size)[0]
+
+    def _lower_bound(self, key):
+        lo, hi = 0, self.n_records
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key(mid) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _string(self, index):
+        offset, length = STRING.unpack_from(
+            self._mm, self._strings_at + index * STRING.size)
+        start = self._pool_at + offset
+        return self._mm[start:start + length].decode('utf-8')
+
+    def records(self):
+        '''Yield every ``(key, stream_id, place_id, offset, length)``.'''
+        for i in range(self.n_records):
+            key, sid, pid, offset, length = RECORD.unpack_from(
+                self._mm, self._records_at + i * RECORD.size)
+            yield key, self._string(sid), self._string(pid), offset, length
+
+    def _scan(self, ranges, accept):
+        for low, high in ranges:
+            i = self._lower_bound(low)
+            while i < self.n_records:
+                key, sid, pid, offset, length = RECORD.unpack_from(
+                    self._mm, self._records_at + i * RECORD.size)
+                if key > high:
+                    break
+                i += 1
+                lat, lng = decode(key)
+                if accept(lat, lng):
+                    yield Hit(self._string(sid), self._string(pid),
+                              lat, lng, offset, length)
+
+    def bbox(self, min_lat, min_lng, max_lat, max_lng):
+        '''Find mentions of places inside a bounding box.
+
+        A box with `min_lng` greater than `max_lng` crosses the
+        antimeridian.
+
+        :return: iterator of :class:`Hit`
+
+        '''
+        if min_lng > max_lng:
+            boxes = [(min_lng, 180.0), (-180.0, max_lng)]
+        else:
+            boxes = [(min_lng, max_lng)]
+        for lng0, lng1 in boxes:
+            def accept(lat, lng, lng0=lng0, lng1=lng1):
+                return min_lat <= lat <= max_lat and lng0 <= lng <= lng1
+            ranges = _cover(min_lat, lng0, max_lat, lng1)
+            for hit in self._scan(ranges, accept):
+                yield hit
+
+    def radius(self, lat, lng, km):
+        '''Find mentions of places within `km` kilometers of a point.
+
+        :return: iterator of :class:`Hit`
+
+        '''
+        dlat = math.degrees(km / EARTH_RADIUS_KM)
+        min_lat, max_lat = lat - dlat, lat + dlat
+        if min_lat <= -90 or max_lat >= 90:
+            # the circle contains a pole, so every longitude is in range
+            min_lng, max_lng = -180.0, 180.0
+        else:
+            dlng = math.degrees(math.asin(min(1.0, math.sin(
+                km / EARTH_RADIUS_KM) / math.cos(math.radians(lat)))))
+            min_lng, max_lng = lng - dlng, lng + dlng
+            if min_lng < -180:
+                min_lng += 360
+            if max_lng > 180:
+                max_lng -= 360
+            if dlng >= 180:
+                min_lng, max_lng = -180.0, 180.0
+        for hit in self.bbox(max(min_lat, -90.0), min_lng,
+                             min(max_lat, 90.0), max_lng):
+            if haversine_km(lat, lng, hit.latitude, hit.longitude) <= km:
+                yield hit
+
+
+def merge(paths, output):
+    '''Merge the index files at `paths` into one at `output`.
+
+    :return: number of records written
+
+    '''
+    indexes = [GeoIndex(path) for path in paths]
+    try:
+        return write_index(heapq.merge(*[idx.records() for idx in indexes]),
+                           output)
+    finally:
+        for idx in indexes:
+            idx.close()
+
+
+def chunk_index_name(chunk):
+    '''Get the index file name for input chunk `chunk`.
+
+    The name is the chunk's base name, so it is easy to find, plus a
+    short hash of the whole of `chunk`, so chunks with the same base
+    name in different directories do not overwrite each other.
+
+    '''
+    data = chunk if isinstance(chunk, bytes) else chunk.encode('utf-8')
+    return '%s-%s.geoidx' % (os.path.basename(chunk.rstrip('/')),
+                             hashlib.sha1(data).hexdigest()[:8])
+
+
+class ChunkGeoIndexer(object):
+    '''Write one index per input chunk into a directory.
+
+    Used by :class:`~streamcorpus_opensextant.tagger.OpenSextantTagger`;
+    the chunk is identified by ``i_str`` in the pipeline context.  Each
+    index is written when the next chunk begins, on :meth:`flush`, or
+    when the process exits.
+
+    '''
+
+    def __init__(self, directory):
+        self.directory = directory
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self.chunk = None
+        self.writer = None
+        self._unnamed = 0
+        # the pipeline never shuts down incremental transforms, so
+        # this is the only way the last chunk's index gets written
+        atexit.register(self.flush)
+
+    def begin(self, context):
+        chunk = (context or {}).get('i_str')
+        if self.writer is None or chunk != self.chunk:
+            self.flush()
+            self.chunk = chunk
+            if chunk:
+                name = chunk_index_name(chunk)
+            else:
+                self._unnamed += 1
+                name = 'opensextant-%d-%d.geoidx' % (os.getpid(),
+                                                     self._unnamed)
+            self.writer = GeoIndexWriter(os.path.join(self.directory, name))
+
+    def add(self, si, results):
+        for anno in results.get('annoList', []):
+            if anno['type'] != 'PLACE':
+                continue
+            place = anno['features']['place']
+            self.writer.add(si.stream_id, place['placeID'],
+                            place['latitude'], place['longitude'],
+                            anno['start'], anno['end'] - anno['start'])
+
+    def flush(self):
+        if self.writer is not None and self.writer.records:
+            count = self.writer.close()
+            logger.info('wrote %d places to %s', count, self.writer.path)
+        self.writer = None
+
+
+def main():
+    '''Merge or query geo index files.'''
+    parser = argparse.ArgumentParser(
+        description='merge and query opensextant geo index files')
+    sub = parser.add_subparsers(dest='command')
+    merge_parser = sub.add_parser('merge', help='merge index files')
+    merge_parser.add_argument('output')
+    merge_parser.add_argument('inputs', nargs='+')
+    query_parser = sub.add_parser('query', help='find places in a region')
+    query_parser.add_argument('index')
+    group = query_parser.add_mutually_exclusive_group(required=True)
+    group.add_argument('--bbox', help='MIN_LAT,MIN_LNG,MAX_LAT,MAX_LNG')
+    group.add_argument('--radius', help='LAT,LNG,KM')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.command == 'merge':
+        count = merge(args.inputs, args.output)
+        logger.info('merged %d records into %s', count, args.output)
+        return
+    index = GeoIndex(args.index)
+    try:
+        if args.bbox:
+            hits = index.bbox(*[float(v) for v in args.bbox.split(',')])
+        else:
+            hits = index.radius(*[float(v) for v in args.radius.split(',')])
+        for hit in hits:
+            print(json.dumps(hit._asdict()))
+    finally:
+        index.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+'''Priority lanes for requests to the OpenSextant service
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+When one OpenSextant fleet serves both bulk backfills and
+low-latency tagging of fresh documents, the backfill can take every
+connection and starve the interactive traffic.  With
+``max_concurrency`` set,
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` sends
+each request through a :class:`LaneScheduler` that allows at most that
+many requests in flight to the backend at once, split among priority
+classes:
+
+.. code-block:: yaml
+
+    opensextant:
+      max_concurrency: 8
+      priority_class: bulk
+      priority_classes:
+        interactive: {weight: 4, reserved: 0.25}
+        bulk: {weight: 1, reserved: 0}
+
+Each class has its own queue of waiting requests.  ``reserved`` is
+the share of ``max_concurrency`` held for the class alone, rounded up
+to whole requests; a reserved slot is never lent out, so however busy
+the other classes are, a request in the class waits only for the
+class's own earlier requests.  The rest of the slots are shared, and
+when one frees up it goes to a waiting class by weighted fair
+(stride) scheduling, in proportion to ``weight``.  Classes without a
+reservation can only use shared slots, so if rounding up would leave
+none, the largest reservation gives one up; with ``max_concurrency:
+1`` and the classes above, ``interactive`` reserves nothing.
+
+Every item uses ``priority_class`` unless the pipeline context has a
+``priority`` naming another class.  The wait for a slot and the whole
+request, including waits and retries, are recorded per class as the
+``opensextant_lane_wait_seconds`` and ``opensextant_lane_seconds``
+histograms.
+
+Schedulers are shared by all taggers in a process that talk to the
+same service URL, as the threads of :mod:`streamcorpus_opensextant.benchmark`
+do; separate worker processes each have their own.
+
+.. autoclass:: LaneScheduler
+.. autofunction:: get_scheduler
+
+'''
+from __future__ import absolute_import
+from collections import deque
+from contextlib import contextmanager
+import logging
+import math
+import threading
+import time
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+
+class _Ticket(object):
+    __slots__ = ('granted',)
+
+    def __init__(self):
+        self.granted = False
+
+
+class LaneScheduler(object):
+    '''Concurrency limit shared among weighted, partly reserved lanes.
+
+    .. automethod:: __init__
+    .. automethod:: acquire
+    .. automethod:: release
+    .. automethod:: slot
+
+    '''
+
+    def __init__(self, capacity, lanes):
+        '''Create a scheduler.
+
+        Reservations are rounded up to whole slots, except that one
+        slot is left shared if any lane has no reservation.
+
+        :param int capacity: most requests in flight at once
+        :param dict lanes: map of lane name to a dictionary with
+          ``weight`` (default 1) and ``reserved`` share of `capacity`
+          (default 0)
+        :raise ValueError: if the lanes reserve more than `capacity`
+
+        '''
+        self.capacity = int(capacity)
+        if self.capacity < 1:
+            raise ValueError('max_concurrency must be at least 1')
+        if not lanes:
+            raise ValueError('priority_classes must name at least one class')
+        self.weights = {}
+        self.reserved = {}
+        for name, spec in lanes.items():
+            spec = spec or {}
+            weight = float(spec.get('weight', 1))
+            if weight <= 0:
+                raise ValueError('weight of priority class %r must be '
+                                 'positive' % name)
+            self.weights[name] = weight
+            self.reserved[name] = int(math.ceil(
+                float(spec.get('reserved', 0)) * self.capacity))
+        if sum(self.reserved.values()) > self.capacity:
+            raise ValueError('priority_classes reserve more than '
+                             'max_concurrency %d' % self.capacity)
+        if sum(self.reserved.values()) == self.capacity and \
+                not all(self.reserved.values()):
+            # a lane without a reservation would never get a slot
+            lane = max(self.reserved,
+                       key=lambda name: (self.reserved[name], name))
+            self.reserved[lane] -= 1
+            logger.warn('priority class %s reserves %d of max_concurrency '
+                        '%d, leaving one shared slot', lane,
+                        self.reserved[lane], self.capacity)
+        self.shared = self.capacity - sum(self.reserved.values())
+        self.active = dict((name, 0) for name in lanes)
+        self.queues = dict((name, deque()) for name in lanes)
+        # stride scheduling: each grant advances a lane's pass by
+        # 1/weight, and the waiting lane with the lowest pass goes next
+        self._pass = dict((name, 0.0) for name in lanes)
+        self._vtime = 0.0
+        self._cond = threading.Condition(threading.Lock())
+
+    def _shared_used(self):
+        return sum(max(0, self.active[name] - self.reserved[name])
+                   for name in self.active)
+
+    def _dispatch(self):
+        granted = False
+        while True:
+            waiting = [name for name, queue in self.queues.items() if queue]
+            if not waiting:
+                break
+            own = [name for name in waiting
+                   if self.active[name] < self.reserved[name]]
+            if own:
+                lane = min(own, key=lambda name: (self._pass[name], name))
+            elif self._shared_used() < self.shared:
+                lane = min(waiting,
+                           key=lambda name: (self._pass[name], name))
+            else:
+                break
+            self._vtime = max(self._vtime, self._pass[lane])
+            self._pass[lane] += 1.0 / self.weights[lane]
+            self.active[lane] += 1
+            self.queues[lane].popleft().granted = True
+            granted = True
+        if granted:
+            self._cond.notify_all()
+
+    def acquire(self, lane):
+        '''Wait for a slot in `lane`.
+
+        :return: seconds spent waiting
+        :raise KeyError: if `lane` is not a lane of this scheduler
+
+        '''
+        start = time.time()
+        ticket = _Ticket()
+        with self._cond:
+            queue = self.queues[lane]
+            if not queue:
+                # an idle lane does not get credit for the time it was
+                # idle
+                self._pass[lane] = max(self._pass[lane], self._vtime)
+            queue.append(ticket)
+            self._dispatch()
+            while not ticket.granted:
+                self._cond.wait()
+        return time.time() - start
+
+    def release(self, lane):
+        '''Give back a slot acquired in `lane`.'''
+        with self._cond:
+            self.active[lane] -= 1
+            self._dispatch()
+
+    @contextmanager
+    def slot(self, lane):
+        '''Context manager holding a slot in `lane`; yields the wait.'''
+        waited = self.acquire(lane)
+        try:
+            yield waited
+        finally:
+            self.release(lane)
+
+    def queued(self):
+        '''Get the number of requests waiting in each lane.'''
+        with self._cond:
+            return dict((name, len(queue))
+                        for name, queue in self.queues.items())
+
+
+_schedulers = {}
+_schedulers_lock = threading.Lock()
+
+
+def get_scheduler(key, capacity, lanes):
+    '''Get the process-wide scheduler for `key`, creating it if needed.
+
+    Taggers for the same service URL share one scheduler; the first
+    to ask decides its `capacity` and `lanes`.
+
+    '''
+    with _schedulers_lock:
+        scheduler = _schedulers.get(key)
+        if scheduler is None:
+            scheduler = _schedulers[key] = LaneScheduler(capacity, lanes)
+        elif scheduler.capacity != int(capacity) or \
+                set(scheduler.weights) != set(lanes):
+            logger.warn('using existing priority lanes for %s with '
+                        'max_concurrency %d and classes %s', key,
+                        scheduler.capacity, ', '.join(sorted(
+                            scheduler.weights)))
+        return scheduler
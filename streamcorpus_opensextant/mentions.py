@@ -0,0 +1,103 @@
+'''Resolve overlapping OpenSextant annotations into token mentions
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+The OpenSextant service returns annotations that can overlap: a
+person's name inside an organization's, or nested geographic spans.
+Each token can carry only one ``entity_type`` and ``mention_id``, so
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` gives
+each token to the highest-priority annotation covering it, chosen by
+``mention_priority``:
+
+``longest`` (the default)
+  the annotation spanning the most characters
+``depth``
+  the annotation with the most specific (deepest) ``hierarchy``
+``bias``
+  the place with the highest ``nameBias``; annotations without one
+  count as 0
+
+Ties go to the annotation that starts first, then the longer one,
+then the one first in the response.  Annotations with no entity type
+never claim tokens.  An annotation covers the tokens whose first
+character is inside its span, and it becomes a mention if it wins at
+least one of them; mentions are numbered densely from 0 in order of
+their first token.
+
+:func:`resolve_mentions` sorts the annotations once and sweeps over
+the tokens in order, keeping the annotations that have started in a
+heap by priority and dropping ended ones as they reach its top.
+This takes O((tokens + annotations) log annotations) time, since the
+tokens of a tokenized document are already in order.
+
+.. autofunction:: resolve_mentions
+
+'''
+from __future__ import absolute_import
+import heapq
+
+from streamcorpus import OffsetType
+
+#: names of the ``mention_priority`` choices
+priorities = ('longest', 'depth', 'bias')
+
+
+def _priority(anno, priority):
+    if priority == 'longest':
+        return anno['end'] - anno['start']
+    if priority == 'depth':
+        return len(anno['features']['hierarchy'].split('.'))
+    return anno['features'].get('place', {}).get('nameBias') or 0.0
+
+
+def resolve_mentions(annos, tokens, classify, priority='longest'):
+    '''Assign tokens to non-overlapping mentions.
+
+    :param list annos: OpenSextant annotations, with character
+      ``start`` and ``end``
+    :param tokens: iterable of :class:`streamcorpus.Token` with
+      character offsets
+    :param classify: function of an annotation returning its
+      ``(entity_type, mention_type)``, or :const:`None` if it has no
+      entity type
+    :param str priority: one of :data:`priorities`
+    :return: iterator of ``(token, mention_id, entity_type,
+      mention_type)`` for each token in a mention
+
+    '''
+    if priority not in priorities:
+        raise ValueError('mention_priority must be one of %s, not %r'
+                         % (', '.join(priorities), priority))
+    # (start, heap key, end, types) of each typed annotation
+    pending = []
+    for index, anno in enumerate(annos):
+        types = classify(anno)
+        if types is None:
+            continue
+        start, end = anno['start'], anno['end']
+        key = (-_priority(anno, priority), start, start - end, index)
+        pending.append((start, key, end, types))
+    pending.sort()
+
+    tokens = sorted(tokens,
+                    key=lambda tok: tok.offsets[OffsetType.CHARS].first)
+    # heap of (key, end, types) for annotations that have started
+    active = []
+    mention_ids = {}
+    i = 0
+    for tok in tokens:
+        first = tok.offsets[OffsetType.CHARS].first
+        while i < len(pending) and pending[i][0] <= first:
+            _, key, end, types = pending[i]
+            heapq.heappush(active, (key, end, types))
+            i += 1
+        while active and active[0][1] <= first:
+            heapq.heappop(active)
+        if not active:
+            continue
+        key, _, (entity_type, mention_type) = active[0]
+        mention_id = mention_ids.get(key)
+        if mention_id is None:
+            mention_id = mention_ids[key] = len(mention_ids)
+        yield tok, mention_id, entity_type, mention_type
@@ -0,0 +1,229 @@
+'''Counters and histograms for the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` keeps a
+:class:`Registry` of metrics in its ``metrics`` attribute.  Take a
+:meth:`Registry.snapshot` to read them from code, or configure
+``metrics_path`` to have the stage write them in the Prometheus text
+exposition format every ``metrics_interval`` seconds and at shutdown,
+for example into a node_exporter textfile collector directory:
+
+.. code-block:: yaml
+
+    opensextant:
+      metrics_path: /var/lib/node_exporter/opensextant.prom
+      metrics_interval: 30
+
+Updating a metric is an attribute increment, or a bisect and two
+increments for a histogram, so metrics are always on.  Updates are
+not locked; under concurrent threads an occasional increment may be
+lost, which is acceptable for monitoring.
+
+.. autoclass:: Registry
+.. autoclass:: Counter
+.. autoclass:: Histogram
+.. autoclass:: MetricsFile
+
+'''
+from __future__ import absolute_import
+from bisect import bisect_left
+import logging
+import os
+import time
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+#: default histogram buckets for durations, in seconds
+latency_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra is not None:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{%s}' % ','.join(
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+        for k, v in items)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    '''Monotonically increasing count.'''
+    __slots__ = ('value',)
+    kind = 'counter'
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+    def samples(self, name, labels):
+        yield name + _format_labels(labels), self.value
+
+
+class Gauge(Counter):
+    '''Value that can go up and down.'''
+    __slots__ = ()
+    kind = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    '''Distribution of observed values over fixed buckets.'''
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+    kind = 'histogram'
+
+    def __init__(self, buckets=latency_buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def snapshot(self):
+        cumulative = []
+        total = 0
+        for count in self.counts:
+            total += count
+            cumulative.append(total)
+        return {
+            'buckets': dict(zip(self.buckets + (float('inf'),), cumulative)),
+            'sum': self.sum,
+            'count': self.count,
+        }
+
+    def samples(self, name, labels):
+        total = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            total += count
+            yield (name + '_bucket' +
+                   _format_labels(labels, ('le', _format_value(bound))),
+                   total)
+        yield name + '_sum' + _format_labels(labels), self.sum
+        yield name + '_count' + _format_labels(labels), self.count
+
+
+class Registry(object):
+    '''Named, labelled metrics.
+
+    Metrics are created on first use and returned on later calls with
+    the same name and labels; hold on to the returned object in hot
+    paths rather than looking it up every time.
+
+    .. automethod:: counter
+    .. automethod:: gauge
+    .. automethod:: histogram
+    .. automethod:: snapshot
+    .. automethod:: prometheus_text
+
+    '''
+
+    def __init__(self):
+        self._help = {}
+        self._kinds = {}
+        self._metrics = {}
+
+    def _get(self, cls, name, help, labels, *args):
+        key = (name, tuple(sorted((labels or {}).items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            if self._kinds.setdefault(name, cls.kind) != cls.kind:
+                raise ValueError('metric %s is a %s, not a %s'
+                                 % (name, self._kinds[name], cls.kind))
+            self._help.setdefault(name, help)
+            metric = self._metrics[key] = cls(*args)
+        return metric
+
+    def counter(self, name, help='', labels=None):
+        '''Get the :class:`Counter` `name` with `labels`.'''
+        return self._get(Counter, name, help, labels)
+
+    def gauge(self, name, help='', labels=None):
+        '''Get the :class:`Gauge` `name` with `labels`.'''
+        return self._get(Gauge, name, help, labels)
+
+    def histogram(self, name, help='', labels=None, buckets=latency_buckets):
+        '''Get the :class:`Histogram` `name` with `labels`.'''
+        return self._get(Histogram, name, help, labels, buckets)
+
+    def snapshot(self):
+        '''Get current values of all metrics.
+
+        :return: dictionary mapping metric name to a list of
+          ``(labels, value)`` pairs, where `labels` is a dictionary and
+          `value` is a number, or for histograms a dictionary of
+          cumulative ``buckets``, ``sum`` and ``count``
+
+        '''
+        snap = {}
+        for (name, labels), metric in sorted(self._metrics.items()):
+            snap.setdefault(name, []).append(
+                (dict(labels), metric.snapshot()))
+        return snap
+
+    def prometheus_text(self):
+        '''Render all metrics in the Prometheus text format.'''
+        lines = []
+        last_name = None
+        for (name, labels), metric in sorted(self._metrics.items()):
+            if name != last_name:
+                if self._help.get(name):
+                    lines.append('# HELP %s %s' % (name, self._help[name]))
+                lines.append('# TYPE %s %s' % (name, metric.kind))
+                last_name = name
+            for sample, value in metric.samples(name, labels):
+                lines.append('%s %s' % (sample, _format_value(value)))
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsFile(object):
+    '''Periodically write a :class:`Registry` to a file.
+
+    The file is replaced atomically, so a collector never reads a
+    partial write.
+
+    '''
+
+    def __init__(self, registry, path, interval=60):
+        self.registry = registry
+        self.path = path
+        self.interval = interval
+        self._next = time.time() + interval
+
+    def maybe_write(self):
+        '''Write the metrics if `interval` has passed since the last write.'''
+        now = time.time()
+        if now >= self._next:
+            self._next = now + self.interval
+            self.write()
+
+    def write(self):
+        '''Write the metrics now.'''
+        tmp = '%s.tmp.%d' % (self.path, os.getpid())
+        try:
+            with open(tmp, 'w') as fh:
+                fh.write(self.registry.prometheus_text())
+            os.rename(tmp, self.path)
+        except (IOError, OSError):
+            logger.warn('could not write metrics to %s', self.path,
+                        exc_info=True)
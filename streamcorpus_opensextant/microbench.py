@@ -0,0 +1,259 @@
+'''Microbenchmarks for the in-process phases of the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Apart from waiting on the network,
+:meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.process_item`
+spends its time in four phases, which this module times separately
+on recorded responses:
+
+``json_loads``
+  decoding the response body
+``filter``
+  :meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.filter`
+``geo_selectors``
+  :meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.get_geo_selectors`,
+  including geojson serialization
+``annotate_sentences``
+  :meth:`~streamcorpus_opensextant.tagger.OpenSextantTagger.annotate_sentences`
+
+Inputs are the ``query-*.json`` test fixtures, synthetic responses of
+increasing size built with :mod:`streamcorpus_opensextant.synthetic`
+and :func:`~streamcorpus_opensextant.standin.synthesize_response`,
+and any other recorded response files named on the command line
+(a response must carry the ``content`` the service echoes back, which
+is used as ``clean_visible``).  Slow-document captures (see
+:mod:`streamcorpus_opensextant.capture`) can be named too, either one
+capture directory or a whole spool at a time.  Sentences are built by a simple
+whitespace tokenizer outside the timed region, so the numbers do not
+depend on nltk.
+
+Each phase reports the best and median wall time over ``--repeat``
+runs.  Allocations are measured in a separate, untimed run: net
+objects left alive according to :mod:`gc`, and, where
+:mod:`tracemalloc` is available, bytes allocated at peak.
+
+.. code-block:: bash
+
+    streamcorpus_opensextant_microbench --repeat 20 --output micro.json
+
+.. autofunction:: load_inputs
+.. autofunction:: run_phases
+
+'''
+from __future__ import absolute_import
+import argparse
+from copy import deepcopy
+import gc
+import glob
+import json
+import logging
+import os
+import random
+import re
+import time
+
+from streamcorpus import make_stream_item, OffsetType, Sentence, Token
+from streamcorpus.ttypes import Offset
+
+from streamcorpus_opensextant.capture import iter_captures, load_capture
+from streamcorpus_opensextant.standin import synthesize_response
+from streamcorpus_opensextant.synthetic import make_text
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+clock = getattr(time, 'monotonic', time.time)
+
+phases = ['json_loads', 'filter', 'geo_selectors', 'annotate_sentences']
+
+#: sizes in bytes of the synthetic inputs
+synthetic_sizes = [1024, 16 * 1024, 256 * 1024, 2 * 1024 * 1024]
+
+fixture_dir = os.path.join(os.path.dirname(__file__), 'tests')
+
+token_re = re.compile(r'\S+', re.UNICODE)
+
+
+def tokenize(text):
+    '''Split :class:`unicode` `text` into :class:`streamcorpus.Sentence`.
+
+    Tokens are whitespace-separated and carry character offsets, as
+    from `nltk_tokenizer`; a sentence ends at a token ending in a
+    period.
+
+    '''
+    sentences = [Sentence(tokens=[])]
+    for match in token_re.finditer(text):
+        offset = Offset(type=OffsetType.CHARS, first=match.start(),
+                        length=match.end() - match.start())
+        tok = Token(token=match.group().encode('utf8'),
+                    offsets={OffsetType.CHARS: offset})
+        sentences[-1].tokens.append(tok)
+        if match.group().endswith(u'.'):
+            sentences.append(Sentence(tokens=[]))
+    if not sentences[-1].tokens:
+        sentences.pop()
+    return sentences
+
+
+def load_response(path):
+    '''Load a recorded response file as a benchmark input.
+
+    :return: ``(name, clean_visible, raw_response)``
+
+    '''
+    if os.path.isdir(path):
+        _, clean_visible, raw = load_capture(path)
+        return os.path.basename(path), clean_visible, raw
+    with open(path, 'rb') as fh:
+        raw = fh.read()
+    text = json.loads(raw)['content']
+    return os.path.basename(path), text.encode('utf8'), raw
+
+
+def load_inputs(paths=None, sizes=None, seed=0):
+    '''Collect benchmark inputs, smallest first.
+
+    :param list paths: recorded response files or slow-document
+      capture directories or spools, the test fixtures by default
+    :param list sizes: sizes of synthetic inputs to generate,
+      :data:`synthetic_sizes` by default
+    :return: list of ``(name, clean_visible, raw_response)``
+
+    '''
+    if paths is None:
+        paths = sorted(glob.glob(os.path.join(fixture_dir, 'query-*.json')))
+    expanded = []
+    for path in paths:
+        if os.path.isdir(path) and not os.path.exists(
+                os.path.join(path, 'capture.json')):
+            expanded.extend(iter_captures(path))
+        else:
+            expanded.append(path)
+    inputs = [load_response(path) for path in expanded]
+    inputs = [i for i in inputs if i[2] is not None]
+    rng = random.Random(seed)
+    for size in (synthetic_sizes if sizes is None else sizes):
+        text = make_text(size, rng)
+        raw = json.dumps(synthesize_response(text)).encode('utf8')
+        inputs.append(('synthetic-%d' % size, text.encode('utf8'), raw))
+    inputs.sort(key=lambda i: len(i[2]))
+    return inputs
+
+
+def _prepare(clean_visible, raw, sentences):
+    si = make_stream_item(10, 'microbench')
+    si.body.clean_visible = clean_visible
+    si.body.sentences['nltk_tokenizer'] = sentences
+    return si, json.loads(raw)
+
+
+def _run_phase(tagger, phase, si, raw, results):
+    if phase == 'json_loads':
+        json.loads(raw)
+    elif phase == 'filter':
+        tagger.filter(results)
+    elif phase == 'geo_selectors':
+        list(tagger.get_geo_selectors(results))
+    elif phase == 'annotate_sentences':
+        tagger.annotate_sentences(si, results)
+
+
+def _allocations(tagger, phase, clean_visible, raw, sentences):
+    si, results = _prepare(clean_visible, raw, sentences)
+    gc.collect()
+    before = len(gc.get_objects())
+    if tracemalloc is not None:
+        tracemalloc.start()
+    _run_phase(tagger, phase, si, raw, results)
+    peak = None
+    if tracemalloc is not None:
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    gc.collect()
+    return len(gc.get_objects()) - before, peak
+
+
+def run_phases(inputs, repeat=10, config=None):
+    '''Time every phase on every input.
+
+    :param list inputs: as from :func:`load_inputs`
+    :param int repeat: timed runs of each phase
+    :param dict config: tagger configuration, the defaults if omitted
+    :return: list of result dictionaries, one per input and phase
+
+    '''
+    tagger = OpenSextantTagger(config or
+                               deepcopy(OpenSextantTagger.default_config))
+    results = []
+    for name, clean_visible, raw in inputs:
+        sentences = tokenize(clean_visible.decode('utf8'))
+        n_annotations = len(json.loads(raw).get('annoList', []))
+        for phase in phases:
+            times = []
+            for _ in range(repeat):
+                si, parsed = _prepare(clean_visible, raw, sentences)
+                start = clock()
+                _run_phase(tagger, phase, si, raw, parsed)
+                times.append(clock() - start)
+            times.sort()
+            objects, peak = _allocations(tagger, phase, clean_visible, raw,
+                                         sentences)
+            results.append({
+                'input': name,
+                'phase': phase,
+                'clean_visible_bytes': len(clean_visible),
+                'response_bytes': len(raw),
+                'annotations': n_annotations,
+                'repeat': repeat,
+                'best_sec': times[0],
+                'median_sec': times[len(times) // 2],
+                'retained_objects': objects,
+                'peak_alloc_bytes': peak,
+            })
+    tagger.shutdown()
+    return results
+
+
+def main():
+    '''Run the microbenchmarks and write the results as JSON.'''
+    parser = argparse.ArgumentParser(
+        description='time the in-process phases of the opensextant stage')
+    parser.add_argument('responses', nargs='*',
+                        help='recorded response files or slow-document '
+                        'captures to use instead of the test fixtures')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--sizes', default=','.join(
+        str(s) for s in synthetic_sizes),
+        help='comma-separated sizes of synthetic inputs, or empty')
+    parser.add_argument('--output', help='write JSON results here')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    sizes = [int(s) for s in args.sizes.split(',') if s]
+    inputs = load_inputs(args.responses or None, sizes)
+    results = run_phases(inputs, repeat=args.repeat)
+    for r in results:
+        logger.info('%-24s %-20s %10d bytes %6d annos  best %9.6fs  '
+                    'median %9.6fs', r['input'], r['phase'],
+                    r['clean_visible_bytes'], r['annotations'],
+                    r['best_sec'], r['median_sec'])
+    output = json.dumps({'benchmark': 'streamcorpus_opensextant.microbench',
+                         'time': time.time(), 'results': results},
+                        indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as fh:
+            fh.write(output + '\n')
+    else:
+        print(output)
+
+
+if __name__ == '__main__':
+    main()
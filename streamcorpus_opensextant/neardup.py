@@ -0,0 +1,363 @@
+'''Reuse the tagging of near-duplicate documents
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Syndicated news puts many near-identical copies of a story into a
+corpus, differing only in a header, a footer or an edited paragraph.
+With ``neardup: true``,
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` keeps a
+:class:`NearDupIndex` of the documents it has tagged for the life of
+the stage.  When a new item closely matches one of them, only the
+parts of the new item that differ are sent to the service, and the
+earlier annotations of the rest are carried over with their offsets
+moved:
+
+.. code-block:: yaml
+
+    opensextant:
+      neardup: true
+      neardup_threshold: 0.8
+      neardup_max_chars: 67108864
+      neardup_verify_rate: 0.01
+
+Documents are sketched with one-permutation MinHash over word
+5-shingles and bucketed by locality-sensitive hashing, so a lookup
+costs time linear in the new document plus the few candidates that
+share a band.  The best candidate with estimated Jaccard similarity at
+least ``neardup_threshold`` is diffed against the new document by
+sentence (text up to ``.``, ``!`` or ``?`` and whitespace, or a line
+break).  Each run of new or changed sentences, widened by one
+unchanged sentence on each side for context, becomes a request; if
+the requests would cover most of the document, it is tagged in full.
+Annotations from the requests are kept where they touch the changed
+text, and carried-over annotations are kept everywhere else.
+
+The index holds at most ``neardup_max_chars`` characters of text,
+dropping the least recently matched documents first.  A
+``neardup_verify_rate`` fraction of reused items are also tagged in
+full and the two results compared; mismatches are counted, logged,
+and resolved in favor of the full tagging.  Reuse and the bytes not
+sent are counted in the stage's metrics and logged at shutdown;
+verified items send the whole document, so they avoid no bytes.
+
+.. autoclass:: NearDupIndex
+.. autoclass:: Reuse
+.. autofunction:: same_annotations
+
+'''
+from __future__ import absolute_import
+from bisect import bisect_right
+from collections import OrderedDict
+import difflib
+import json
+import logging
+import re
+import zlib
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+_word_re = re.compile(r'\w+', re.UNICODE)
+_sentence_end_re = re.compile(r'[.!?]\s+|\n+', re.UNICODE)
+
+# bin value of an empty one-permutation MinHash bin
+_EMPTY = 1 << 32
+
+
+def segments(text):
+    '''Get the start offsets of the sentences of `text`.
+
+    Ends with ``len(text)``, so consecutive pairs are the sentences.
+
+    '''
+    offsets = [0]
+    for match in _sentence_end_re.finditer(text):
+        offsets.append(match.end())
+    if offsets[-1] != len(text):
+        offsets.append(len(text))
+    return offsets
+
+
+def _touches(start, end, core_start, core_end):
+    '''Does the span ``[start, end)`` overlap a core region?
+
+    An empty core marks where text was deleted, and is touched by
+    spans that contain it.
+
+    '''
+    if core_start == core_end:
+        return start < core_start < end
+    return start < core_end and end > core_start
+
+
+class Reuse(object):
+    '''Plan for tagging a near-duplicate of an earlier document.
+
+    .. attribute:: windows
+
+       list of ``(start, end)`` character ranges of the new document
+       to send to the service
+
+    .. attribute:: carried
+
+       annotations carried over from the earlier document, already
+       moved to the new document's offsets
+
+    .. automethod:: merge
+
+    '''
+
+    def __init__(self, text, windows, cores, carried, extra):
+        self.text = text
+        self.windows = windows
+        self.cores = cores
+        self.carried = carried
+        self.extra = extra
+
+    def merge(self, window_results):
+        '''Combine the service results for :attr:`windows`.
+
+        :param list window_results: decoded response for each window
+        :return: results dictionary for the whole new document
+
+        '''
+        annos = list(self.carried)
+        for (start, _), cores, results in zip(self.windows, self.cores,
+                                              window_results):
+            for anno in results.get('annoList', []):
+                a_start = anno['start'] + start
+                a_end = anno['end'] + start
+                if any(_touches(a_start, a_end, c_start, c_end)
+                       for c_start, c_end in cores):
+                    anno = dict(anno)
+                    anno['start'] = a_start
+                    anno['end'] = a_end
+                    annos.append(anno)
+        annos.sort(key=lambda anno: (anno['start'], anno['end']))
+        results = dict(self.extra)
+        if 'content' in results:
+            results['content'] = self.text
+        results['annoList'] = annos
+        return results
+
+
+class _Document(object):
+    __slots__ = ('text', 'annos', 'extra', 'signature', 'keys')
+
+    def __init__(self, text, annos, extra, signature, keys):
+        self.text = text
+        self.annos = annos
+        self.extra = extra
+        self.signature = signature
+        self.keys = keys
+
+
+class NearDupIndex(object):
+    '''MinHash/LSH index of tagged documents.
+
+    .. automethod:: __init__
+    .. automethod:: sketch
+    .. automethod:: find
+    .. automethod:: add
+
+    '''
+
+    def __init__(self, threshold=0.8, num_perm=64, bands=16,
+                 shingle_size=5, max_chars=1 << 26, min_chars=256,
+                 max_window_fraction=0.5):
+        '''Create an empty index.
+
+        :param float threshold: least estimated Jaccard similarity of
+          a near-duplicate
+        :param int num_perm: MinHash bins per sketch
+        :param int bands: LSH bands, each of ``num_perm / bands`` bins
+        :param int shingle_size: words per shingle
+        :param int max_chars: most characters of text to hold
+        :param int min_chars: shorter documents are not indexed
+        :param float max_window_fraction: tag in full when the
+          requests would cover more of the document than this
+
+        '''
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.threshold = float(threshold)
+        self.num_perm = num_perm
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self.max_window_fraction = max_window_fraction
+        self.chars = 0
+        self._buckets = [{} for _ in range(bands)]
+        # id -> _Document, least recently used first
+        self._docs = OrderedDict()
+        self._next_id = 0
+
+    def __len__(self):
+        return len(self._docs)
+
+    def sketch(self, text):
+        '''Get the MinHash signature of :class:`unicode` `text`.
+
+        :return: tuple of :attr:`num_perm` bin minimums, or
+          :const:`None` if `text` is too short to index
+
+        '''
+        if len(text) < self.min_chars:
+            return None
+        words = _word_re.findall(text.lower())
+        if not words:
+            return None
+        k = min(self.shingle_size, len(words))
+        num_perm = self.num_perm
+        signature = [_EMPTY] * num_perm
+        for i in range(len(words) - k + 1):
+            h = zlib.crc32(u' '.join(words[i:i + k]).encode('utf-8')) \
+                & 0xFFFFFFFF
+            b = h % num_perm
+            v = h // num_perm
+            if v < signature[b]:
+                signature[b] = v
+        return tuple(signature)
+
+    def _band_keys(self, signature):
+        rows = self.rows
+        return [signature[i * rows:(i + 1) * rows]
+                for i in range(len(self._buckets))]
+
+    def similarity(self, sig_a, sig_b):
+        '''Estimate the Jaccard similarity of two signatures.'''
+        same = used = 0
+        for a, b in zip(sig_a, sig_b):
+            if a == _EMPTY and b == _EMPTY:
+                continue
+            used += 1
+            if a == b:
+                same += 1
+        return float(same) / used if used else 0.0
+
+    def find(self, text, signature):
+        '''Plan reusing an earlier document for `text`.
+
+        :param text: :class:`unicode` clean_visible of the new document
+        :param signature: :meth:`sketch` of `text`
+        :return: :class:`Reuse`, or :const:`None` if there is no
+          near-duplicate worth reusing
+
+        '''
+        if signature is None:
+            return None
+        candidates = set()
+        for bucket, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+        best, best_sim = None, self.threshold
+        for doc_id in candidates:
+            sim = self.similarity(signature, self._docs[doc_id].signature)
+            if sim >= best_sim:
+                best, best_sim = doc_id, sim
+        if best is None:
+            return None
+        # keep recently matched documents longest
+        doc = self._docs.pop(best)
+        self._docs[best] = doc
+        return self._plan(doc, text)
+
+    def _plan(self, doc, text):
+        old_offsets = segments(doc.text)
+        new_offsets = segments(text)
+        old_segs = [doc.text[a:b]
+                    for a, b in zip(old_offsets, old_offsets[1:])]
+        new_segs = [text[a:b] for a, b in zip(new_offsets, new_offsets[1:])]
+        matcher = difflib.SequenceMatcher(None, old_segs, new_segs,
+                                          autojunk=False)
+
+        # equal blocks as (old start, old end, shift to new offsets)
+        blocks = []
+        # changed regions of the new text, in segment indexes
+        changed = []
+        prev_i = prev_j = 0
+        for i, j, n in matcher.get_matching_blocks():
+            if i > prev_i or j > prev_j:
+                changed.append((prev_j, j))
+            if n:
+                blocks.append((old_offsets[i], old_offsets[i + n],
+                               new_offsets[j] - old_offsets[i]))
+            prev_i, prev_j = i + n, j + n
+
+        # widen each change by a sentence on each side, merging
+        windows = []
+        cores = []
+        last = len(new_segs)
+        for j0, j1 in changed:
+            w0 = new_offsets[max(j0 - 1, 0)]
+            w1 = new_offsets[min(j1 + 1, last)]
+            core = (new_offsets[j0], new_offsets[j1])
+            if windows and w0 <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], max(windows[-1][1], w1))
+                cores[-1].append(core)
+            else:
+                windows.append((w0, w1))
+                cores.append([core])
+        if sum(w1 - w0 for w0, w1 in windows) > \
+                self.max_window_fraction * len(text):
+            return None
+
+        all_cores = [core for window_cores in cores for core in window_cores]
+        block_starts = [start for start, _, _ in blocks]
+        carried = []
+        for anno in doc.annos:
+            k = bisect_right(block_starts, anno['start']) - 1
+            if k < 0 or anno['end'] > blocks[k][1]:
+                continue
+            shift = blocks[k][2]
+            start, end = anno['start'] + shift, anno['end'] + shift
+            if any(_touches(start, end, c_start, c_end)
+                   for c_start, c_end in all_cores):
+                continue
+            anno = dict(anno)
+            anno['start'] = start
+            anno['end'] = end
+            carried.append(anno)
+        return Reuse(text, windows, cores, carried, doc.extra)
+
+    def add(self, text, results, signature):
+        '''Index `text`, tagged with the decoded `results`.
+
+        Does nothing if `signature` is :const:`None`.
+
+        '''
+        if signature is None:
+            return
+        extra = dict((k, v) for k, v in results.items()
+                     if k not in ('annoList', 'content'))
+        if 'content' in results:
+            # the service echoes the whole text; Reuse.merge puts the
+            # new text back, so only note that it was there
+            extra['content'] = None
+        keys = self._band_keys(signature)
+        doc_id = self._next_id
+        self._next_id += 1
+        self._docs[doc_id] = _Document(
+            text, list(results.get('annoList', [])), extra, signature, keys)
+        for bucket, key in zip(self._buckets, keys):
+            bucket.setdefault(key, []).append(doc_id)
+        self.chars += len(text)
+        while self.chars > self.max_chars and len(self._docs) > 1:
+            self._evict()
+
+    def _evict(self):
+        doc_id, doc = self._docs.popitem(last=False)
+        for bucket, key in zip(self._buckets, doc.keys):
+            ids = bucket[key]
+            ids.remove(doc_id)
+            if not ids:
+                del bucket[key]
+        self.chars -= len(doc.text)
+
+
+def same_annotations(results_a, results_b):
+    '''Do two results dictionaries hold the same annotations?'''
+    def key(results):
+        return sorted(json.dumps(anno, sort_keys=True)
+                      for anno in results.get('annoList', []))
+    return key(results_a) == key(results_b)
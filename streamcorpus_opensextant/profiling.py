@@ -0,0 +1,242 @@
+'''Per-phase timing and sampled profiling of the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+With ``profile_phases: true``,
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` times
+each phase of every stream item:
+
+``neardup``
+  looking for an earlier near-duplicate of the item
+``request``
+  waiting on the OpenSextant service, including retries
+``gazetteer``
+  in-process gazetteer matching
+``json_loads``
+  decoding the response
+``filter``
+  dropping low-confidence places
+``annotate_sentences``
+  labelling tokens
+``geo_selectors``
+  building ``GEOJSON`` selectors
+
+Timings are summed per input chunk (a change of ``i_str`` in the
+pipeline context) and logged when the chunk changes, at shutdown, and
+at exit (the pipeline never shuts the stage down), and every phase
+feeds an ``opensextant_phase_seconds`` histogram in the stage's
+metrics.  Additionally, ``profile_sample_rate`` of the items, a
+fraction between 0 and 1, are run under :mod:`cProfile` and their
+stats written as ``<stream_id>.pstats`` into ``profile_dir``:
+
+.. code-block:: yaml
+
+    opensextant:
+      profile_phases: true
+      profile_sample_rate: 0.001
+      profile_dir: /tmp/opensextant-profiles
+
+When ``profile_phases`` is off, each phase boundary costs one call to
+a function returning a shared do-nothing context manager.
+
+.. autoclass:: PhaseProfiler
+.. autoclass:: ItemTimings
+
+'''
+from __future__ import absolute_import
+import atexit
+from collections import deque
+import cProfile
+import logging
+import os
+import random
+import re
+import time
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+# time.monotonic is only in Python 3; fall back to wall-clock time
+clock = getattr(time, 'monotonic', time.time)
+
+
+class _NullPhase(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_null_phase = _NullPhase()
+
+
+def null_phases(name):
+    '''Phase timer that records nothing.'''
+    return _null_phase
+
+
+class _Phase(object):
+    __slots__ = ('timings', 'name', 'start')
+
+    def __init__(self, timings, name):
+        self.timings = timings
+        self.name = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.timings.add(self.name, clock() - self.start)
+        return False
+
+
+class ItemTimings(object):
+    '''Phase durations for one stream item.
+
+    Call it with a phase name to get a context manager timing that
+    phase.  :attr:`durations` maps phase names to seconds; a phase
+    entered more than once accumulates.
+
+    '''
+
+    def __init__(self):
+        self.durations = {}
+        self.start = clock()
+        self.total = None
+
+    def __call__(self, name):
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        self.durations[name] = self.durations.get(name, 0.0) + seconds
+
+    def finish(self):
+        self.total = clock() - self.start
+        return self
+
+    def to_dict(self):
+        timings = dict(self.durations)
+        timings['total'] = self.total
+        return timings
+
+
+class PhaseProfiler(object):
+    '''Aggregate :class:`ItemTimings` per chunk and sample cProfile runs.
+
+    .. automethod:: __init__
+    .. automethod:: begin
+    .. automethod:: end
+    .. automethod:: sample
+    .. automethod:: profile
+    .. automethod:: flush
+
+    '''
+
+    def __init__(self, registry=None, sample_rate=0.0, pstats_dir=None,
+                 seed=None):
+        '''Create a profiler.
+
+        :param registry: :class:`~streamcorpus_opensextant.metrics.Registry`
+          to record phase histograms in
+        :param float sample_rate: fraction of items to run under
+          :mod:`cProfile`
+        :param str pstats_dir: directory for pstats files, required if
+          `sample_rate` is not zero
+
+        '''
+        if sample_rate and not pstats_dir:
+            raise ValueError('profile_sample_rate requires profile_dir')
+        self.registry = registry
+        self.sample_rate = float(sample_rate or 0)
+        self.pstats_dir = pstats_dir
+        if pstats_dir and not os.path.isdir(pstats_dir):
+            os.makedirs(pstats_dir)
+        self._rng = random.Random(seed)
+        self._histograms = {}
+        self.chunk = None
+        self.items = 0
+        self.totals = {}
+        #: summaries of recent chunks, as from :meth:`flush`
+        self.chunk_summaries = deque(maxlen=1000)
+        # the pipeline never shuts down incremental transforms, so
+        # the last chunk is only logged here
+        atexit.register(self.flush)
+
+    def begin(self, context=None):
+        '''Start timing an item; returns its :class:`ItemTimings`.'''
+        chunk = (context or {}).get('i_str')
+        if chunk != self.chunk:
+            if self.items:
+                self.flush()
+            self.chunk = chunk
+        return ItemTimings()
+
+    def end(self, timings):
+        '''Finish timing an item and add it to the chunk totals.'''
+        timings.finish()
+        self.items += 1
+        for name, seconds in timings.to_dict().items():
+            self.totals[name] = self.totals.get(name, 0.0) + seconds
+            if self.registry is not None:
+                hist = self._histograms.get(name)
+                if hist is None:
+                    hist = self._histograms[name] = self.registry.histogram(
+                        'opensextant_phase_seconds',
+                        'time spent in one phase of one stream item',
+                        {'phase': name})
+                hist.observe(seconds)
+        return timings
+
+    def sample(self):
+        '''Decide whether to run the next item under cProfile.'''
+        return self.sample_rate > 0 and self._rng.random() < self.sample_rate
+
+    def profile(self, func, si):
+        '''Call ``func(si)`` under cProfile and save the stats.
+
+        Errors writing the stats are logged, not raised.
+
+        '''
+        profiler = cProfile.Profile()
+        try:
+            return profiler.runcall(func, si)
+        finally:
+            name = re.sub(r'[^\w.-]', '_', si.stream_id or 'unknown')
+            path = os.path.join(self.pstats_dir, name + '.pstats')
+            try:
+                profiler.dump_stats(path)
+                logger.debug('wrote profile of %s to %s', si.stream_id, path)
+            except (IOError, OSError):
+                logger.warn('could not write profile of %s to %s',
+                            si.stream_id, path, exc_info=True)
+
+    def flush(self):
+        '''Log and reset the totals for the current chunk.
+
+        :return: summary dictionary with ``chunk``, ``items`` and
+          per-phase ``seconds``, or :const:`None` if no items were
+          timed
+
+        '''
+        if not self.items:
+            return None
+        summary = {
+            'chunk': self.chunk,
+            'items': self.items,
+            'seconds': dict(self.totals),
+        }
+        self.chunk_summaries.append(summary)
+        total = self.totals.get('total') or 1e-9
+        logger.info(
+            'opensextant phase times for %d items from %s: %s',
+            self.items, self.chunk, ', '.join(
+                '%s %.3fs (%.0f%%)' % (name, seconds, 100 * seconds / total)
+                for name, seconds in sorted(self.totals.items(),
+                                            key=lambda kv: -kv[1])
+                if name != 'total'))
+        self.items = 0
+        self.totals = {}
+        return summary
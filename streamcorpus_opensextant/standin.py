@@ -0,0 +1,375 @@
+'''Local stand-in for the OpenSextant REST service
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+:class:`StandinServer` is a small threaded HTTP server implementing
+the endpoints :class:`~streamcorpus_opensextant.tagger.OpenSextantTagger`
+uses:
+
+``/opensextant/extract/``
+  lists the available extractors, like the real service
+``/opensextant/extract/general/json``, ``/opensextant/extract/geo/json``
+  return an ``annoList`` for the POSTed text
+
+Responses come from a response archive (see
+:mod:`streamcorpus_opensextant.archive`) when one is given and holds
+the request, and are otherwise synthesized by
+:func:`synthesize_response`, which tags a small built-in list of
+place names and runs of capitalized words.  The server can inject a
+latency distribution, an error rate, requests that never get an
+answer, and a cap on how many requests it serves at once, which makes
+it suitable for exercising the tagger's HTTP client, retries and
+concurrency under load without a JVM.
+
+In tests, use the ``standin_server`` fixture from the package's
+``conftest.py``.  To run one by hand:
+
+.. code-block:: bash
+
+    streamcorpus_opensextant_standin --port 8182 --latency lognormal:-3:0.5 \\
+        --error-rate 0.01 --max-concurrency 8
+
+.. autoclass:: StandinServer
+.. autofunction:: synthesize_response
+.. autofunction:: make_latency
+
+'''
+from __future__ import absolute_import
+import argparse
+import json
+import logging
+import random
+import re
+import threading
+import time
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+
+from streamcorpus_opensextant.archive import ArchiveReader, request_key
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+SERVICE_PATH = '/opensextant/extract/'
+
+#: place names tagged by :func:`synthesize_response`, with
+#: (placeID, latitude, longitude)
+places = {
+    u'Paris': (u'NGA-1456928', 48.86667, 2.33333),
+    u'Texas': (u'USGS1779801', 31.25044, -99.25061),
+    u'France': (u'NGA-1429', 46.0, 2.0),
+    u'Canada': (u'NGA-1365', 60.0, -96.0),
+    u'Montreal': (u'NGA-6077243', 45.50884, -73.58781),
+    u'Liberia': (u'NGA-1426', 6.5, -9.5),
+    u'London': (u'NGA-2643743', 51.50853, -0.12574),
+    u'Berlin': (u'NGA-2950159', 52.52437, 13.41053),
+    u'Tokyo': (u'NGA-1850147', 35.6895, 139.69171),
+    u'Cairo': (u'NGA-360630', 30.06263, 31.24967),
+    u'Moscow': (u'NGA-524901', 55.75222, 37.61556),
+    u'Lagos': (u'NGA-2332459', 6.45407, 3.39467),
+    u'Lima': (u'NGA-3936456', -12.04318, -77.02824),
+    u'Sydney': (u'NGA-2147714', -33.86785, 151.20732),
+    u'Boston': (u'USGS4930956', 42.35843, -71.05977),
+    u'Chicago': (u'USGS4887398', 41.85003, -87.65005),
+}
+
+capitalized_re = re.compile(r'\b[A-Z]\w*(?:\s+[A-Z]\w*)*', re.UNICODE)
+
+
+def _place_anno(start, end, name):
+    pid, lat, lng = places[name]
+    return {
+        'start': start,
+        'end': end,
+        'type': 'PLACE',
+        'matchText': name,
+        'features': {
+            'hierarchy': 'Geo.place.namedPlace',
+            'isEntity': True,
+            'place': {
+                'placeName': name,
+                'placeID': pid,
+                'latitude': lat,
+                'longitude': lng,
+                'nameBias': 0.5,
+            },
+        },
+    }
+
+
+def synthesize_response(text, general=True):
+    '''Make a plausible OpenSextant response for :class:`unicode` `text`.
+
+    Every name in :data:`places` becomes a PLACE annotation.  If
+    `general` is true, as for the ``general`` extractor, other runs of
+    two or more capitalized words become ``Person.name.personName``
+    annotations.
+
+    :return: response dictionary with ``content`` and ``annoList``
+
+    '''
+    anno_list = []
+    for match in capitalized_re.finditer(text):
+        words = list(re.finditer(r'\w+', match.group(), re.UNICODE))
+        pending = []
+        for word in words + [None]:
+            if word is not None and word.group() not in places:
+                pending.append(word)
+                continue
+            if general and len(pending) >= 2:
+                start = match.start() + pending[0].start()
+                end = match.start() + pending[-1].end()
+                anno_list.append({
+                    'start': start,
+                    'end': end,
+                    'type': 'Person',
+                    'matchText': text[start:end],
+                    'features': {
+                        'hierarchy': 'Person.name.personName',
+                        'isEntity': True,
+                    },
+                })
+            pending = []
+            if word is not None:
+                anno_list.append(_place_anno(
+                    match.start() + word.start(),
+                    match.start() + word.end(),
+                    word.group()))
+    return {'content': text, 'annoList': anno_list}
+
+
+def make_latency(spec, rng=None):
+    '''Make a latency sampler from a string `spec`.
+
+    `spec` is one of ``fixed:SECONDS``, ``uniform:LOW:HIGH``,
+    ``exponential:MEAN`` or ``lognormal:MU:SIGMA``.  The result is a
+    function of no arguments returning a delay in seconds.
+
+    '''
+    rng = rng or random.Random()
+    kind, _, args = spec.partition(':')
+    args = [float(a) for a in args.split(':')] if args else []
+    if kind == 'fixed' and len(args) == 1:
+        return lambda: args[0]
+    if kind == 'uniform' and len(args) == 2:
+        return lambda: rng.uniform(args[0], args[1])
+    if kind == 'exponential' and len(args) == 1:
+        return lambda: rng.expovariate(1.0 / args[0])
+    if kind == 'lognormal' and len(args) == 2:
+        return lambda: rng.lognormvariate(args[0], args[1])
+    raise ValueError('bad latency spec %r' % spec)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    # keep-alive, so the tagger's connection pool is exercised
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, fmt, *args):
+        logger.debug('standin: ' + fmt, *args)
+
+    def do_GET(self):
+        self.handle_request(b'')
+
+    def do_POST(self):
+        length = int(self.headers.get('content-length') or 0)
+        self.handle_request(self.rfile.read(length))
+
+    def handle_request(self, body):
+        standin = self.server.standin
+        path = self.path.split('?', 1)[0]
+        if path.rstrip('/') == SERVICE_PATH.rstrip('/'):
+            self.reply(200, json.dumps(['general', 'geo']).encode('utf-8'))
+            return
+        if path not in (SERVICE_PATH + 'general/json',
+                        SERVICE_PATH + 'geo/json'):
+            self.reply(404, b'not found')
+            return
+        standin.serve(self, path, body)
+
+    def reply(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json; charset=UTF-8')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+
+class StandinServer(object):
+    '''Threaded HTTP server imitating the OpenSextant service.
+
+    After :meth:`start`, :attr:`network_address` is suitable for the
+    tagger's ``network_address`` configuration.  Counters of what the
+    server did are kept in :attr:`stats`.
+
+    .. automethod:: __init__
+    .. automethod:: start
+    .. automethod:: stop
+
+    '''
+
+    def __init__(self, host='127.0.0.1', port=0, archive_path=None,
+                 latency=None, error_rate=0.0, timeout_rate=0.0,
+                 max_concurrency=None, reject_excess=False, seed=None):
+        '''Configure a stand-in server.
+
+        :param str host: interface to listen on
+        :param int port: port to listen on, or 0 for any free port
+        :param str archive_path: response archive to serve from
+        :param latency: delay to add to each request, as a function
+          returning seconds or a :func:`make_latency` spec string
+        :param float error_rate: fraction of requests answered with
+          HTTP 500
+        :param float timeout_rate: fraction of requests never answered
+          (the connection is held until :meth:`stop`)
+        :param int max_concurrency: most requests served at once
+        :param bool reject_excess: if true, requests over
+          `max_concurrency` get HTTP 503 instead of waiting
+        :param seed: seed for the random choices
+
+        '''
+        self.host = host
+        self.port = port
+        self.rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        if isinstance(latency, str):
+            latency = make_latency(latency, self.rng)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.reject_excess = reject_excess
+        self._slots = (threading.Semaphore(max_concurrency)
+                       if max_concurrency else None)
+        self.archive = ArchiveReader(archive_path) if archive_path else None
+        self.stats = dict(requests=0, served=0, errors=0, timeouts=0,
+                          rejected=0, active=0, max_active=0)
+        self._stats_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._server = None
+        self._thread = None
+
+    @property
+    def network_address(self):
+        return '%s:%d' % (self.host, self.port)
+
+    def start(self):
+        '''Start serving in a background thread.'''
+        self._server = _ThreadingHTTPServer((self.host, self.port), _Handler)
+        self._server.standin = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info('OpenSextant stand-in listening on %s',
+                    self.network_address)
+        return self
+
+    def stop(self):
+        '''Stop serving and release held connections.'''
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            self._server = None
+        if self.archive is not None:
+            self.archive.close()
+            self.archive = None
+
+    def _count(self, name, delta=1):
+        with self._stats_lock:
+            self.stats[name] += delta
+            if name == 'active':
+                self.stats['max_active'] = max(self.stats['max_active'],
+                                               self.stats['active'])
+
+    def _random(self):
+        with self._rng_lock:
+            return self.rng.random()
+
+    def serve(self, handler, path, body):
+        self._count('requests')
+        if self._slots is not None:
+            if not self._slots.acquire(not self.reject_excess):
+                self._count('rejected')
+                handler.reply(503, b'too many concurrent requests')
+                return
+        self._count('active')
+        try:
+            if self.latency is not None:
+                self._stopping.wait(self.latency())
+            roll = self._random()
+            if roll < self.timeout_rate:
+                self._count('timeouts')
+                self._stopping.wait()
+                handler.close_connection = True
+                return
+            if roll < self.timeout_rate + self.error_rate:
+                self._count('errors')
+                handler.reply(500, b'injected error')
+                return
+            handler.reply(200, self.response(path, body))
+            self._count('served')
+        finally:
+            self._count('active', -1)
+            if self._slots is not None:
+                self._slots.release()
+
+    def response(self, path, body):
+        '''Get the response body to send for a request.'''
+        if self.archive is not None:
+            content = self.archive.get(request_key('POST', path, body))
+            if content is not None:
+                return content
+        results = synthesize_response(body.decode('utf-8', 'replace'),
+                                      general=path.endswith('general/json'))
+        return json.dumps(results).encode('utf-8')
+
+
+def main():
+    '''Run a stand-in OpenSextant server until interrupted.'''
+    parser = argparse.ArgumentParser(
+        description='serve a local stand-in for the OpenSextant REST service')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8182)
+    parser.add_argument('--archive', help='response archive to serve from')
+    parser.add_argument('--latency', help='latency spec, e.g. fixed:0.05, '
+                        'uniform:0.01:0.1, exponential:0.05 or '
+                        'lognormal:-3:0.5')
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--timeout-rate', type=float, default=0.0)
+    parser.add_argument('--max-concurrency', type=int)
+    parser.add_argument('--reject-excess', action='store_true',
+                        help='answer 503 over max-concurrency '
+                        'instead of queueing')
+    parser.add_argument('--seed', type=int)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    server = StandinServer(
+        host=args.host, port=args.port, archive_path=args.archive,
+        latency=args.latency, error_rate=args.error_rate,
+        timeout_rate=args.timeout_rate,
+        max_concurrency=args.max_concurrency,
+        reject_excess=args.reject_excess, seed=args.seed).start()
+    try:
+        while True:
+            time.sleep(60)
+            logger.info('stand-in stats: %r', server.stats)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+'''Startup helpers for the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+:class:`~streamcorpus_opensextant.tagger.OpenSextantTagger` can
+optionally do some work when it is constructed so that problems and
+costs show up before the first document rather than on it:
+
+``health_check: true``
+  ask the service for its list of extractors, the same probe the
+  tests use, and raise :exc:`yakonfig.ConfigurationError` at once if
+  the service cannot be reached or does not offer the needed
+  extractor; ``health_check_timeout`` bounds the wait
+``prewarm_connections: N``
+  open `N` keep-alive connections to the service, paying the TCP and
+  TLS handshakes up front, and size the connection pool to hold them
+
+The stage also logs, and records as the
+``opensextant_first_item_seconds`` gauge, the time from process start
+to the first tagged item, as measured by :func:`process_start_time`.
+
+.. autofunction:: check_service
+.. autofunction:: prewarm
+.. autofunction:: process_start_time
+
+'''
+from __future__ import absolute_import
+import json
+import logging
+import os
+import time
+
+import yakonfig
+
+logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
+
+# fallback for process_start_time where /proc is not available
+_import_time = time.time()
+
+
+def process_start_time():
+    '''Get the time this process started, in seconds since the epoch.
+
+    Uses ``/proc`` on Linux; elsewhere, falls back to the time this
+    module was imported.
+
+    '''
+    try:
+        with open('/proc/self/stat') as fh:
+            # the command name may contain spaces, so split after it
+            fields = fh.read().rsplit(')', 1)[1].split()
+        # field 22 of stat, counted from the pid
+        start_ticks = int(fields[19])
+        with open('/proc/stat') as fh:
+            for line in fh:
+                if line.startswith('btime '):
+                    boot_time = int(line.split()[1])
+                    break
+            else:
+                return _import_time
+        return boot_time + float(start_ticks) / os.sysconf('SC_CLK_TCK')
+    except (IOError, OSError, IndexError, ValueError):
+        return _import_time
+
+
+def check_service(session, url, backend, timeout=5, verify=False):
+    '''Check that the OpenSextant service at `url` offers `backend`.
+
+    `url` is the service path ending in ``/extract/``, which lists
+    the available extractors.
+
+    :raise yakonfig.ConfigurationError: if it does not
+
+    '''
+    try:
+        response = session.post(url, timeout=timeout, verify=verify)
+        response.raise_for_status()
+        extractors = json.loads(response.content)
+    except Exception as exc:
+        raise yakonfig.ConfigurationError(
+            'OpenSextant service at %s failed health check: %s' % (url, exc))
+    if not isinstance(extractors, list) or backend not in extractors:
+        raise yakonfig.ConfigurationError(
+            'OpenSextant service at %s does not offer the %s extractor: %r'
+            % (url, backend, extractors))
+    logger.info('OpenSextant service at %s offers %s', url,
+                ', '.join(map(str, extractors)))
+
+
+def prewarm(adapter, url, count, verify=False, cert=None):
+    '''Open `count` pooled connections to the host of `url`.
+
+    Connections are established (including any TLS handshake) and
+    returned to `adapter`'s pool without sending a request, so the
+    pool must hold at least `count` connections.
+
+    :param adapter: :class:`requests.adapters.HTTPAdapter`
+    :return: number of connections opened
+
+    '''
+    pool = adapter.get_connection(url)
+    if url.startswith('https'):
+        adapter.cert_verify(pool, url, verify, cert)
+    conns = []
+    try:
+        for _ in range(count):
+            conn = pool._get_conn()
+            conns.append(conn)
+            conn.connect()
+    finally:
+        for conn in conns:
+            pool._put_conn(conn)
+    logger.debug('opened %d connections to %s', len(conns), url)
+    return len(conns)
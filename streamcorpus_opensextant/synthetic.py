@@ -0,0 +1,109 @@
+'''Synthetic documents for benchmarking the opensextant stage
+
+.. This software is released under an MIT/X11 open source license.
+   Copyright 2014-2015 Diffeo, Inc.
+
+Generates English-looking ``clean_visible`` text sprinkled with the
+person and place names that
+:func:`streamcorpus_opensextant.standin.synthesize_response` knows
+how to tag, in three shapes:
+
+``tweet``
+  a sentence or two, about 140 bytes
+``news``
+  a few paragraphs, about 5 KB
+``page``
+  a multi-megabyte page, about 2 MB
+
+Generation is deterministic for a given seed.
+
+.. autofunction:: make_text
+.. autofunction:: make_corpus
+
+'''
+from __future__ import absolute_import
+import random
+
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.standin import places
+
+#: approximate ``clean_visible`` size in bytes of each document kind
+document_sizes = {
+    'tweet': 140,
+    'news': 5 * 1024,
+    'page': 2 * 1024 * 1024,
+}
+
+words = u'''the of and to in a is that for it as was with be by on not he
+this are or his from at which but have an they you were her she there
+been one all we their has would when if so no will more said who about
+what up its than into them only some could new other after people time
+two first also years report officials city government week minister
+according country president police meeting statement talks border
+market river said today region capital forces agreement visit'''.split()
+
+given_names = u'''John Maria Ahmed Li Olga Kwame Sofia Raj Elena Tom Amara
+Hiroshi Fatima Pedro Anna'''.split()
+
+family_names = u'''Smith Garcia Hassan Wang Petrova Mensah Rossi Patel
+Novak Brown Okafor Tanaka Khan Silva Berg'''.split()
+
+place_names = sorted(places)
+
+
+def _sentence(rng):
+    parts = []
+    for _ in range(rng.randint(6, 18)):
+        roll = rng.random()
+        if roll < 0.06:
+            parts.append(rng.choice(place_names))
+        elif roll < 0.09:
+            parts.append(u'%s %s' % (rng.choice(given_names),
+                                     rng.choice(family_names)))
+        else:
+            parts.append(rng.choice(words))
+    sentence = u' '.join(parts)
+    return sentence[0].upper() + sentence[1:] + u'.'
+
+
+def make_text(size, rng=None):
+    '''Generate about `size` bytes of :class:`unicode` text.
+
+    Sentences are grouped into paragraphs separated by blank lines.
+    The result is cut at a sentence boundary once it reaches `size`
+    bytes, so it may be slightly longer.
+
+    '''
+    rng = rng or random.Random()
+    paragraphs = []
+    length = 0
+    while length < size:
+        paragraph = []
+        for _ in range(rng.randint(1, 6)):
+            sentence = _sentence(rng)
+            paragraph.append(sentence)
+            length += len(sentence) + 1
+            if length >= size:
+                break
+        paragraphs.append(u' '.join(paragraph))
+        length += 2
+    return u'\n\n'.join(paragraphs)
+
+
+def make_corpus(kind, count, seed=0):
+    '''Generate `count` stream items of document `kind`.
+
+    :param str kind: one of ``tweet``, ``news`` or ``page``
+    :return: list of :class:`streamcorpus.StreamItem` with
+      ``clean_visible`` set
+
+    '''
+    rng = random.Random(seed)
+    items = []
+    for i in range(count):
+        si = make_stream_item(1400000000 + i, 'synthetic://%s/%d' % (kind, i))
+        si.body.clean_visible = \
+            make_text(document_sizes[kind], rng).encode('utf-8')
+        items.append(si)
+    return items
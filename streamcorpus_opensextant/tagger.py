@@ -37,6 +37,38 @@ tagger stages.  If desired, you must explicitly include an aligner in
 For all stages that expect a tagger ID, this uses a tagger ID of
 ``opensextant``.  The stage has no configuration beyond `rest_url`
 
+When only PLACE selectors are wanted (``annotate_sentences: false``),
+the stage can also match an in-process gazetteer instead of, or as a
+fallback for, the OpenSextant service; see
+:mod:`streamcorpus_opensextant.gazetteer`.
+
+Responses from the service can be recorded to an archive file and
+replayed later without the service running; see
+:mod:`streamcorpus_opensextant.archive`.
+
+The stage keeps request, annotation and timing metrics, which can be
+written out for Prometheus; see :mod:`streamcorpus_opensextant.metrics`.
+To see where the time goes, it can also time each phase of every
+item and profile a sample of them; see
+:mod:`streamcorpus_opensextant.profiling`.  Unusually slow items can
+be saved for offline reproduction; see
+:mod:`streamcorpus_opensextant.capture`.  The places found in each
+input chunk can be written to a side-index for geographic queries;
+see :mod:`streamcorpus_opensextant.geoindex`.  Near-duplicates of
+documents already tagged can reuse most of the earlier tagging; see
+:mod:`streamcorpus_opensextant.neardup`.
+
+Optional dependencies are imported only when the configuration needs
+them: :mod:`requests` for talking to the service and :mod:`geojson`
+for ``add_geo_selectors``.  With ``annotate_sentences``, overlapping
+annotations are resolved into token mentions by
+``mention_priority``; see :mod:`streamcorpus_opensextant.mentions`.
+Bulk and interactive traffic can be given separate priority lanes to
+the service; see :mod:`streamcorpus_opensextant.lanes`.
+The stage can also check the service and
+open connections to it at startup; see
+:mod:`streamcorpus_opensextant.startup`.
+
 .. autoclass:: OpenSextantTagger
    :show-inheritance:
 
@@ -45,19 +77,26 @@ from __future__ import absolute_import
 import itertools
 import json
 import logging
+import random
 import time
 
-import geojson
-from geojson import Point, Feature
-import requests
-from requests.auth import HTTPBasicAuth
-from sortedcollection import SortedCollection
-
 from streamcorpus import Tagging, make_stream_time, \
     OffsetType, EntityType, MentionType
 from streamcorpus_pipeline.stages import IncrementalTransform
 from streamcorpus.ttypes import Selector, Offset
 
+from streamcorpus_opensextant.capture import SlowCapture
+from streamcorpus_opensextant.gazetteer import Gazetteer
+from streamcorpus_opensextant.geoindex import ChunkGeoIndexer
+from streamcorpus_opensextant.lanes import get_scheduler
+from streamcorpus_opensextant.mentions import priorities, \
+    resolve_mentions
+from streamcorpus_opensextant.metrics import MetricsFile, Registry
+from streamcorpus_opensextant.neardup import NearDupIndex, same_annotations
+from streamcorpus_opensextant.profiling import PhaseProfiler, null_phases
+from streamcorpus_opensextant.startup import check_service, prewarm, \
+    process_start_time
+
 
 logger = logging.getLogger('streamcorpus_pipeline' + '.' + __name__)
 
@@ -97,6 +136,34 @@ class OpenSextantTagger(IncrementalTransform):
         'cert': None,
         'annotate_sentences': True,
         'add_geo_selectors': True,
+        'gazetteer_path': None,
+        'gazetteer_mode': 'fallback',
+        'archive_mode': None,
+        'archive_path': None,
+        'metrics_path': None,
+        'metrics_interval': 60,
+        'profile_phases': False,
+        'profile_sample_rate': 0,
+        'profile_dir': None,
+        'capture_dir': None,
+        'capture_request_seconds': 10,
+        'capture_processing_seconds': 2,
+        'capture_max_bytes': 1 << 30,
+        'health_check': False,
+        'health_check_timeout': 5,
+        'prewarm_connections': 0,
+        'geo_index_dir': None,
+        'neardup': False,
+        'neardup_threshold': 0.8,
+        'neardup_max_chars': 1 << 26,
+        'neardup_verify_rate': 0,
+        'mention_priority': 'longest',
+        'max_concurrency': 0,
+        'priority_class': 'bulk',
+        'priority_classes': {
+            'interactive': {'weight': 4, 'reserved': 0.25},
+            'bulk': {'weight': 1, 'reserved': 0},
+        },
     }
 
     def __init__(self, config, *args, **kwargs):
@@ -121,6 +188,67 @@ class OpenSextantTagger(IncrementalTransform):
         file (containing the private key and the certificate) or as a
         tuple of both file's path `cert=('cert.crt', 'cert.key')`
 
+        Optionally, `config` can set `max_concurrency` to limit the
+        requests in flight to the service from this process, shared
+        among `priority_classes`, each with its own queue, `weight`
+        and `reserved` share.  Items use `priority_class` unless the
+        context names a ``priority``.  See
+        :mod:`streamcorpus_opensextant.lanes`.
+
+        Optionally, `config` can set `mention_priority` to
+        ``longest``, ``depth`` or ``bias`` to choose which of several
+        overlapping annotations labels the tokens they share.  See
+        :mod:`streamcorpus_opensextant.mentions`.
+
+        Optionally, `config` can contain `gazetteer_path`, naming an
+        index built by :mod:`streamcorpus_opensextant.gazetteer`.
+        This is only used when `annotate_sentences` is false.  If
+        `gazetteer_mode` is ``primary``, places come from the
+        gazetteer and the service is never contacted; if it is
+        ``fallback`` (the default), the gazetteer is only used when a
+        request to the service fails.
+
+        Optionally, `config` can contain `archive_mode` of ``record``
+        or ``replay`` together with an `archive_path`.  Recording
+        saves every response from the service into the archive;
+        replaying serves responses from the archive instead of the
+        service.  See :mod:`streamcorpus_opensextant.archive`.
+
+        Metrics are always collected in :attr:`metrics`.  Optionally,
+        `config` can contain `metrics_path`, a file to which they are
+        written in the Prometheus text format every
+        `metrics_interval` seconds and at :meth:`shutdown`.
+
+        Optionally, `config` can set `profile_phases` to time each
+        phase of every item, and `profile_sample_rate` with
+        `profile_dir` to save :mod:`cProfile` stats for that fraction
+        of items.  See :mod:`streamcorpus_opensextant.profiling`.
+
+        Optionally, `config` can contain `capture_dir`, a spool
+        directory into which items slower than
+        `capture_request_seconds` to request or
+        `capture_processing_seconds` to process afterwards are saved,
+        up to `capture_max_bytes`.  This turns on phase timing.  See
+        :mod:`streamcorpus_opensextant.capture`.
+
+        Optionally, `config` can set `health_check` to probe the
+        service's extractor listing now, raising
+        :exc:`yakonfig.ConfigurationError` if it is not usable, and
+        `prewarm_connections` to open that many keep-alive
+        connections now.  See :mod:`streamcorpus_opensextant.startup`.
+
+        Optionally, `config` can contain `geo_index_dir`, a directory
+        into which an index of the places kept for each input chunk
+        is written.  See :mod:`streamcorpus_opensextant.geoindex`.
+
+        Optionally, `config` can set `neardup` to send only the
+        changed parts of near-duplicates of earlier items (with
+        estimated similarity at least `neardup_threshold`) to the
+        service, remembering up to `neardup_max_chars` of text, and
+        `neardup_verify_rate` to also tag that fraction of them in
+        full to check the result.  See
+        :mod:`streamcorpus_opensextant.neardup`.
+
         :param dict config: local configuration dictionary
 
         '''
@@ -134,13 +262,144 @@ class OpenSextantTagger(IncrementalTransform):
         if config.get('annotate_sentences'):
             # use full NER models from GATE, library upon which
             # opensextant is built: https://gate.ac.uk/projects.html
-            self.rest_url += 'general/json'
+            self.backend = 'general'
         else:
             # only use the GEO models from GATE
-            self.rest_url += 'geo/json'
+            self.backend = 'geo'
+        self.rest_url += self.backend + '/json'
 
         self.verify_ssl = config.get('verify_ssl', False)
 
+        self.mention_priority = config.get('mention_priority', 'longest')
+        if self.mention_priority not in priorities:
+            raise ValueError('mention_priority must be one of %s, not %r'
+                             % (', '.join(priorities), self.mention_priority))
+
+        self.gazetteer = None
+        self.gazetteer_mode = config.get('gazetteer_mode', 'fallback')
+        if self.gazetteer_mode not in ('primary', 'fallback'):
+            raise ValueError('gazetteer_mode must be primary or fallback, '
+                             'not %r' % self.gazetteer_mode)
+        gazetteer_path = config.get('gazetteer_path')
+        if gazetteer_path and config.get('annotate_sentences'):
+            logger.warn('ignoring gazetteer_path %s because '
+                        'annotate_sentences needs the full OpenSextant '
+                        'service', gazetteer_path)
+        elif gazetteer_path:
+            self.gazetteer = Gazetteer(gazetteer_path)
+
+        self.archive = None
+        self.session = None
+        self._http_adapter = None
+        if self.gazetteer is None or self.gazetteer_mode != 'primary':
+            self.make_session(config)
+
+        self.metrics = Registry()
+        self.metrics_file = None
+        if config.get('metrics_path'):
+            self.metrics_file = MetricsFile(
+                self.metrics, config['metrics_path'],
+                float(config.get('metrics_interval', 60)))
+        self._backend_metrics = {}
+        m = self.metrics
+        self._items = m.counter(
+            'opensextant_items_total', 'stream items processed')
+        self._item_seconds = m.histogram(
+            'opensextant_item_seconds', 'time to process one stream item')
+        self._annotations_received = m.counter(
+            'opensextant_annotations_received_total',
+            'annotations returned by the backend, before filter')
+        self._annotations_kept = m.counter(
+            'opensextant_annotations_kept_total',
+            'annotations remaining after filter')
+        self._selectors = m.counter(
+            'opensextant_selectors_total', 'GEOJSON selectors emitted')
+        self._alignment_failures = m.counter(
+            'opensextant_alignment_failures_total',
+            'annotations whose matchText differs from clean_visible')
+
+        self.capture = None
+        if config.get('capture_dir'):
+            self.capture = SlowCapture(
+                config['capture_dir'],
+                request_seconds=config.get('capture_request_seconds', 10),
+                processing_seconds=config.get(
+                    'capture_processing_seconds', 2),
+                max_bytes=config.get('capture_max_bytes', 1 << 30))
+
+        self.neardup = None
+        if config.get('neardup'):
+            self.neardup = NearDupIndex(
+                threshold=config.get('neardup_threshold', 0.8),
+                max_chars=int(config.get('neardup_max_chars', 1 << 26)))
+        self.neardup_verify_rate = float(
+            config.get('neardup_verify_rate') or 0)
+        self._neardup_rng = random.Random()
+        self._neardup_reused = m.counter(
+            'opensextant_neardup_reused_total',
+            'stream items tagged by reusing a near-duplicate')
+        self._neardup_bytes_avoided = m.counter(
+            'opensextant_neardup_bytes_avoided_total',
+            'clean_visible bytes not sent because of a near-duplicate')
+        self._neardup_mismatches = m.counter(
+            'opensextant_neardup_mismatches_total',
+            'verified near-duplicate reuses that differed from full tagging')
+
+        self.geo_index = None
+        if config.get('geo_index_dir'):
+            self.geo_index = ChunkGeoIndexer(config['geo_index_dir'])
+
+        self._first_item_seconds = m.gauge(
+            'opensextant_first_item_seconds',
+            'time from process start to the first tagged stream item')
+        self._first_item = True
+
+        self.profiler = None
+        if config.get('profile_phases') or \
+                config.get('profile_sample_rate') or self.capture:
+            self.profiler = PhaseProfiler(
+                registry=self.metrics,
+                sample_rate=config.get('profile_sample_rate'),
+                pstats_dir=config.get('profile_dir'))
+        # called with a phase name around each phase of process_item;
+        # only records anything while the profiler is timing an item
+        self._phases = null_phases
+
+        self.lanes = None
+        self._lane_metrics = {}
+        self.priority_class = config.get('priority_class', 'bulk')
+        self._lane = self.priority_class
+        if self.session is not None and config.get('max_concurrency'):
+            self.lanes = get_scheduler(
+                self.rest_url, config['max_concurrency'],
+                config.get('priority_classes') or {})
+            if self.priority_class not in self.lanes.weights:
+                raise ValueError('priority_class %r is not one of the '
+                                 'priority_classes' % self.priority_class)
+
+        # replayed archives need neither a health check nor connections
+        if self.session is not None and \
+                config.get('archive_mode') != 'replay':
+            if config.get('health_check'):
+                check_service(self.session, self.rest_url[:-len(
+                    self.backend + '/json')], self.backend,
+                    timeout=float(config.get('health_check_timeout', 5)),
+                    verify=self.verify_ssl)
+            count = int(config.get('prewarm_connections') or 0)
+            if count:
+                try:
+                    prewarm(self._http_adapter, self.rest_url, count,
+                            verify=self.verify_ssl, cert=self.session.cert)
+                except Exception:
+                    logger.warn('could not prewarm connections to %s',
+                                self.rest_url, exc_info=True)
+
+    def make_session(self, config):
+        '''Set up :attr:`session` for talking to the service.'''
+        import requests
+        from requests.adapters import HTTPAdapter
+        from requests.auth import HTTPBasicAuth
+
         # Session carries connection pools that automatically provide
         # HTTP keep-alive, so we can send many documents over one
         # connection.
@@ -156,52 +415,278 @@ class OpenSextantTagger(IncrementalTransform):
         elif cert:
             self.session.cert = cert
 
+        # keep enough pooled connections for any prewarmed ones
+        pool_size = max(requests.adapters.DEFAULT_POOLSIZE,
+                        int(config.get('prewarm_connections') or 0))
+        self._http_adapter = HTTPAdapter(pool_maxsize=pool_size)
+        adapter = self._http_adapter
+
+        archive_mode = config.get('archive_mode')
+        archive_path = config.get('archive_path')
+        if archive_mode and not archive_path:
+            raise ValueError('archive_mode %r requires archive_path'
+                             % archive_mode)
+        if archive_mode == 'record':
+            from streamcorpus_opensextant.archive import open_writer, \
+                RecordingAdapter
+            self.archive = open_writer(archive_path)
+            adapter = RecordingAdapter(self.archive, self._http_adapter)
+        elif archive_mode == 'replay':
+            from streamcorpus_opensextant.archive import ArchiveReader, \
+                ReplayAdapter
+            self.archive = ArchiveReader(archive_path)
+            adapter = ReplayAdapter(self.archive)
+        elif archive_mode:
+            raise ValueError('archive_mode must be record or replay, not %r'
+                             % archive_mode)
+        self.session.mount(config.get('scheme', 'http') + '://', adapter)
+
     def shutdown(self):
         '''Try to stop processing.
 
-        Does nothing, since all of the work is done in-process.
+        Closes the gazetteer and any response archive, and writes the
+        place index and phase timings of the last input chunk.  The
+        pipeline does not call this on incremental transforms, so the
+        archive's index, the place index and the timings are also
+        written when the process exits.
 
         '''
-        pass
+        if self.gazetteer is not None:
+            self.gazetteer.close()
+        if self.archive is not None:
+            self.archive.close()
+        if self.profiler is not None:
+            self.profiler.flush()
+        if self.geo_index is not None:
+            self.geo_index.flush()
+        if self.neardup is not None:
+            items = self._items.value or 1
+            logger.info('opensextant reused near-duplicates for %d of %d '
+                        'items (%.1f%%), avoiding %d bytes',
+                        self._neardup_reused.value, self._items.value,
+                        100.0 * self._neardup_reused.value / items,
+                        self._neardup_bytes_avoided.value)
+        if self.metrics_file is not None:
+            self.metrics_file.write()
+
+    def backend_metrics(self, backend):
+        '''Get the per-backend metrics for `backend`.
+
+        :return: dictionary of ``seconds``, ``request_bytes``,
+          ``response_bytes``, ``retries``, ``timeouts`` and
+          ``failures`` metrics
 
-    def request_json(self, si):
+        '''
+        metrics = self._backend_metrics.get(backend)
+        if metrics is None:
+            labels = {'backend': backend}
+            m = self.metrics
+            metrics = self._backend_metrics[backend] = {
+                'seconds': m.histogram(
+                    'opensextant_request_seconds',
+                    'latency of one request to a backend', labels),
+                'request_bytes': m.counter(
+                    'opensextant_request_bytes_total',
+                    'clean_visible bytes sent to a backend', labels),
+                'response_bytes': m.counter(
+                    'opensextant_response_bytes_total',
+                    'response bytes received from a backend', labels),
+                'retries': m.counter(
+                    'opensextant_retries_total',
+                    'requests retried after a timeout', labels),
+                'timeouts': m.counter(
+                    'opensextant_timeouts_total',
+                    'requests that timed out', labels),
+                'failures': m.counter(
+                    'opensextant_failures_total',
+                    'stream items for which a backend failed', labels),
+            }
+        return metrics
+
+    def request_json(self, si, data=None):
         # clean_visible will be UTF-8 encoded
+        if data is None:
+            data = si.body.clean_visible
         logger.debug('POST %d bytes of clean_visible to %s',
-                     len(si.body.clean_visible), self.rest_url)
+                     len(data), self.rest_url)
         headers = {
             'content-encoding': 'UTF-8',
             'content-type': 'text/plain; charset=UTF-8',
         }
+        metrics = self.backend_metrics(self.backend)
+        from requests.exceptions import ReadTimeout
         retries = int(self.config.get('retries', 1))
         tries = 0
-        while tries < retries:
-            tries += 1
-            try:
-                response = self.session.post(
-                    self.rest_url,
-                    data=si.body.clean_visible,
-                    verify=self.verify_ssl,
-                    headers=headers,
-                    timeout=int(self.config.get('timeout', 10)),
-                )
-                break
-            except Exception, exc:
-                if str(exc).startswith('ReadTimeout'):
+        request_start = time.time()
+        try:
+            while tries < retries:
+                tries += 1
+                metrics['request_bytes'].inc(len(data))
+                start = time.time()
+                try:
+                    response = self.post(data, headers)
+                    break
+                except ReadTimeout:
+                    metrics['timeouts'].inc()
+                    if tries >= retries:
+                        raise
+                    metrics['retries'].inc()
                     logger.info('retrying OpenSextant connection: %d of %d',
                                 tries, retries)
                     time.sleep(2**tries)
-                    continue
-                raise
-        # save JSON for testing; make file names based on length of
-        # clean_visible
-        # fname = 'query-%d.json' % len(si.body.clean_visible)
-        # fpath = os.path.join(os.path.dirname(__file__), 'tests', fname)
-        # open(fpath, 'wb').write(response.content)
+                finally:
+                    metrics['seconds'].observe(time.time() - start)
+        finally:
+            if self.lanes is not None:
+                self.lane_metrics(self._lane)['seconds'].observe(
+                    time.time() - request_start)
+        metrics['response_bytes'].inc(len(response.content))
+        # an error page from the service or a proxy is not a response
+        response.raise_for_status()
         return response
 
+    def post(self, data, headers):
+        '''POST `data` to the service once, in the item's priority lane.'''
+        kwargs = dict(
+            data=data,
+            verify=self.verify_ssl,
+            headers=headers,
+            timeout=float(self.config.get('timeout', 10)),
+        )
+        if self.lanes is None:
+            return self.session.post(self.rest_url, **kwargs)
+        with self.lanes.slot(self._lane) as waited:
+            self.lane_metrics(self._lane)['wait'].observe(waited)
+            return self.session.post(self.rest_url, **kwargs)
+
+    def lane_metrics(self, lane):
+        '''Get the ``wait`` and ``seconds`` metrics of priority `lane`.'''
+        metrics = self._lane_metrics.get(lane)
+        if metrics is None:
+            labels = {'class': lane}
+            metrics = self._lane_metrics[lane] = {
+                'wait': self.metrics.histogram(
+                    'opensextant_lane_wait_seconds',
+                    'time a request waited for a slot in its priority '
+                    'class', labels),
+                'seconds': self.metrics.histogram(
+                    'opensextant_lane_seconds',
+                    'time to get a response, including waits and '
+                    'retries, per priority class', labels),
+            }
+        return metrics
+
+    def priority_for(self, context):
+        '''Get the priority class for an item with pipeline `context`.'''
+        lane = (context or {}).get('priority')
+        if lane is None:
+            return self.priority_class
+        if lane not in self.lanes.weights:
+            logger.debug('unknown priority class %r, using %s',
+                         lane, self.priority_class)
+            return self.priority_class
+        return lane
+
+    def extract_gazetteer(self, si):
+        '''Tag `si` with the in-process gazetteer.
+
+        :return: pair of raw JSON string and decoded results, like
+          :meth:`extract`
+
+        '''
+        metrics = self.backend_metrics('gazetteer')
+        start = time.time()
+        with self._phases('gazetteer'):
+            results = self.gazetteer.extract(
+                si.body.clean_visible.decode('utf8'))
+            raw_tagging = json.dumps(results)
+        metrics['seconds'].observe(time.time() - start)
+        metrics['request_bytes'].inc(len(si.body.clean_visible))
+        metrics['response_bytes'].inc(len(raw_tagging))
+        return raw_tagging, results
+
+    def extract(self, si):
+        '''Get OpenSextant results for `si` from the configured backend.
+
+        :return: pair of raw JSON string, to be stored as the
+          ``raw_tagging``, and the decoded results dictionary
+
+        '''
+        if self.gazetteer is not None and self.gazetteer_mode == 'primary':
+            return self.extract_gazetteer(si)
+        reuse = None
+        if self.neardup is not None:
+            with self._phases('neardup'):
+                text = si.body.clean_visible.decode('utf8')
+                signature = self.neardup.sketch(text)
+                reuse = self.neardup.find(text, signature)
+        try:
+            if reuse is not None:
+                raw_tagging, results = self.extract_reused(si, reuse)
+                self.neardup.add(text, results, signature)
+                return raw_tagging, results
+            with self._phases('request'):
+                response = self.request_json(si)
+        except Exception:
+            self.backend_metrics(self.backend)['failures'].inc()
+            if self.gazetteer is None:
+                raise
+            logger.warn('OpenSextant request failed, using gazetteer',
+                        exc_info=True)
+            return self.extract_gazetteer(si)
+        with self._phases('json_loads'):
+            results = json.loads(response.content)
+        if self.neardup is not None:
+            self.neardup.add(text, results, signature)
+        return response.content, results
+
+    def extract_reused(self, si, reuse):
+        '''Get OpenSextant results for a near-duplicate `si`.
+
+        Only the windows of `reuse` are sent to the service.
+
+        :param reuse: :class:`~streamcorpus_opensextant.neardup.Reuse`
+          plan for `si`
+        :return: pair of raw JSON string and decoded results, like
+          :meth:`extract`
+
+        '''
+        window_results = []
+        sent = 0
+        with self._phases('request'):
+            for start, end in reuse.windows:
+                data = reuse.text[start:end].encode('utf8')
+                sent += len(data)
+                response = self.request_json(si, data)
+                window_results.append(json.loads(response.content))
+        results = reuse.merge(window_results)
+        self._neardup_reused.inc()
+        logger.debug('reused near-duplicate tagging for %s, sending %d of '
+                     '%d bytes in %d windows', si.stream_id, sent,
+                     len(si.body.clean_visible), len(reuse.windows))
+
+        if not self.neardup_verify_rate or \
+                self._neardup_rng.random() >= self.neardup_verify_rate:
+            self._neardup_bytes_avoided.inc(
+                len(si.body.clean_visible) - sent)
+        else:
+            # verifying sends the whole document, so nothing is avoided
+            response = self.request_json(si)
+            full = json.loads(response.content)
+            if not same_annotations(results, full):
+                self._neardup_mismatches.inc()
+                logger.warn('near-duplicate tagging of %s differs from '
+                            'full tagging; using full tagging',
+                            si.stream_id)
+                return response.content, full
+        return json.dumps(results), results
+
     def get_geo_selectors(self, results):
         '''Given a JSON result from opensextant, create Selectors
         '''
+        import geojson
+        from geojson import Point, Feature
+
         features = results["annoList"]
 
         # For each feature, if it is a PLACE, yield a Selector
@@ -269,7 +754,9 @@ class OpenSextantTagger(IncrementalTransform):
     def process_item(self, si, context=None):
         '''Run OpenSextant over a single stream item.
 
-        This ignores the `context`, and always returns the input
+        This ignores the `context` (other than noticing a new input
+        chunk when profiling or indexing places, and its ``priority``
+        with priority lanes), and always returns the input
         stream item `si`.  Its sole action is to add a ``opensextant``
         value to the tagger-keyed fields in `si.body`, provided that
         `si` in fact has a
@@ -281,48 +768,89 @@ class OpenSextantTagger(IncrementalTransform):
         :return: `si`
 
         '''
-        if si.body and si.body.clean_visible:
-            response = self.request_json(si)
+        start = time.time()
+        profiler = self.profiler
+        if profiler is not None:
+            self._phases = profiler.begin(context)
+        if self.geo_index is not None:
+            self.geo_index.begin(context)
+        if self.lanes is not None:
+            self._lane = self.priority_for(context)
+        raw_tagging = None
+        try:
+            if si.body and si.body.clean_visible:
+                if profiler is not None and profiler.sample():
+                    raw_tagging = profiler.profile(self.tag, si)
+                else:
+                    raw_tagging = self.tag(si)
+        finally:
+            if self._first_item and raw_tagging is not None:
+                self._first_item = False
+                first_item = time.time() - process_start_time()
+                self._first_item_seconds.set(first_item)
+                logger.info('opensextant tagged its first item %.3fs after '
+                            'process start', first_item)
+            if profiler is not None:
+                timings = profiler.end(self._phases)
+                self._phases = null_phases
+                if self.capture is not None and si.body and \
+                        si.body.clean_visible:
+                    self.capture.check(si, timings.to_dict(), raw_tagging,
+                                       self.rest_url)
+            self._item_seconds.observe(time.time() - start)
+            self._items.inc()
+            if self.metrics_file is not None:
+                self.metrics_file.maybe_write()
+        return si
 
-            results = json.loads(response.content)
+    def tag(self, si):
+        '''Tag `si`, which must have ``clean_visible``.
 
+        :return: the raw response stored as the ``raw_tagging``
+
+        '''
+        raw_tagging, results = self.extract(si)
+        self._annotations_received.inc(len(results.get('annoList', [])))
+
+        with self._phases('filter'):
             results = self.filter(results)
+        self._annotations_kept.inc(len(results['annoList']))
+
+        # remove a Tagging entry from nltk_tokenizer
+        # si.body.taggings.pop('nltk_tokenizer')
+        tagging = Tagging(
+            tagger_id=self.tagger_id,
+            tagger_version='2.1',
+            generation_time=make_stream_time(time.time()),
+            raw_tagging=raw_tagging
+        )
+        si.body.taggings[self.tagger_id] = tagging
 
-            # remove a Tagging entry from nltk_tokenizer
-            # si.body.taggings.pop('nltk_tokenizer')
-            tagging = Tagging(
-                tagger_id=self.tagger_id,
-                tagger_version='2.1',
-                generation_time=make_stream_time(time.time()),
-                raw_tagging=response.content
-            )
-            si.body.taggings[self.tagger_id] = tagging
-
-            if self.config.get('annotate_sentences') is True:
+        if self.config.get('annotate_sentences') is True:
+            with self._phases('annotate_sentences'):
                 self.annotate_sentences(si, results)
 
-            if self.config.get('add_geo_selectors') is True:
+        if self.config.get('add_geo_selectors') is True:
+            with self._phases('geo_selectors'):
                 selectors = list(self.get_geo_selectors(results))
-                logger.info('opensextant added %d selectors', len(selectors))
-                si.body.selectors[self.tagger_id] = selectors
+            logger.info('opensextant added %d selectors', len(selectors))
+            self._selectors.inc(len(selectors))
+            si.body.selectors[self.tagger_id] = selectors
 
-            # si.body.relations[self.tagger_id] = make_relations(result)
-            # si.body.attributes[self.tagger_id] = make_attributes(result)
+        if self.geo_index is not None:
+            self.geo_index.add(si, results)
 
-        return si
+        # si.body.relations[self.tagger_id] = make_relations(result)
+        # si.body.attributes[self.tagger_id] = make_attributes(result)
+        return raw_tagging
 
     def annotate_sentences(self, si, result):
         sentences = si.body.sentences.pop('nltk_tokenizer')
         si.body.sentences[self.tagger_id] = sentences
 
-        toks = SortedCollection(
-            itertools.chain(*[sent.tokens for sent in sentences]),
-            key=lambda tok: tok.offsets[OffsetType.CHARS].first
-            )
-
         cv = si.body.clean_visible.decode('utf8')
-        mention_id = 0
-        for anno in result.get('annoList', []):
+        annos = result.get('annoList', [])
+        for anno in annos:
             # if not anno.get('features', {}).get('isEntity'):
             #     logger.debug('skipping isEntity=False: %s',
             #                  json.dumps(anno, indent=4, sort_keys=True))
@@ -331,34 +859,40 @@ class OpenSextantTagger(IncrementalTransform):
             end = anno['end']
             if not cv[start:end] == anno['matchText']:
                 # these appear to typically be spaces collapsed by OpenSextant
+                self._alignment_failures.inc()
                 pre = 30
                 post = 30
                 logger.debug(
                     'alignment failure:\n\t%s\n\t%s%s%s',
-                    si.body.clean_visible.decode('utf8')[start-pre:end+post],
+                    cv[start-pre:end+post],
                     ' ' * pre,
                     anno['matchText'],
                     ' ' * post)
 
-            for tok in toks.find_range(start, end):
-                fhierarchy = anno['features']['hierarchy']
-                fh_parts = fhierarchy.split('.')
-                if entity_types.get(fhierarchy):
-                    e_type, m_type = entity_types[fhierarchy]
-                elif entity_types.get(fh_parts[0]):
-                    e_type, m_type = entity_types[fh_parts[0]]
-                else:
-                    e_type, m_type = None, None
+        toks = itertools.chain(*[sent.tokens for sent in sentences])
+        for tok, mention_id, e_type, m_type in resolve_mentions(
+                annos, toks, mention_types, self.mention_priority):
+            tok.entity_type = e_type
+            tok.mention_type = m_type
+            tok.mention_id = mention_id
+            # too bad no coref chains, so nominals are not connected
+            # to names:
+            tok.equiv_id = mention_id
 
-                if e_type is not None:
-                    tok.entity_type = e_type
-                    tok.mention_type = m_type
-                    tok.mention_id = mention_id
-                    # too bad no coref chains, so nominals are not connected
-                    # to names:
-                    tok.equiv_id = mention_id
 
-            mention_id += 1
+def mention_types(anno):
+    '''Get the ``(entity_type, mention_type)`` of an annotation.
+
+    Looks up the annotation's full ``hierarchy`` in
+    :data:`entity_types`, then its top level.
+
+    :return: pair of :class:`streamcorpus.EntityType` and
+      :class:`streamcorpus.MentionType`, or :const:`None`
+
+    '''
+    fhierarchy = anno['features']['hierarchy']
+    return entity_types.get(fhierarchy) or \
+        entity_types.get(fhierarchy.split('.')[0])
 
 
 entity_types = {
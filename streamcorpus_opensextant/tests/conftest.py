@@ -0,0 +1,82 @@
+from __future__ import absolute_import
+import json
+import os
+import subprocess
+import sys
+
+import pytest
+
+from streamcorpus_opensextant.standin import StandinServer
+
+# run an OpenSextantTagger through a whole streamcorpus_pipeline
+# Pipeline in a fresh process, so exit-time work happens as in a
+# real run
+PIPELINE_SCRIPT = '''
+import json
+import logging
+import sys
+
+from streamcorpus import make_stream_item
+from streamcorpus_pipeline._pipeline import Pipeline
+
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+config, texts, tmp_dir = json.loads(sys.argv[1])
+logging.basicConfig(level=logging.INFO)
+
+
+def reader(i_str):
+    # the pipeline leaves i_str out of the context, so the stage sees
+    # one unnamed input chunk
+    for n, text in enumerate(texts):
+        si = make_stream_item(10 + n, 'http://example.com/%d' % n)
+        si.body.clean_visible = text.encode('utf8')
+        yield si
+
+pipeline = Pipeline(
+    rate_log_interval=100, input_item_limit=None, cleanup_tmp_files=True,
+    tmp_dir_path=tmp_dir, assert_single_source=False,
+    output_chunk_max_count=None, output_max_clean_visible_bytes=None,
+    reader=reader, incremental_transforms=[OpenSextantTagger(config)],
+    batch_transforms=[], post_batch_incremental_transforms=[], writers=[])
+pipeline.run('input')
+'''
+
+
+@pytest.fixture
+def standin_server(request):
+    '''a running :class:`~streamcorpus_opensextant.standin.StandinServer`
+
+    Parametrize indirectly with a dictionary of constructor keyword
+    arguments to inject latency, errors or concurrency limits.
+
+    '''
+    server = StandinServer(seed=0, **getattr(request, 'param', {}))
+    server.start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def run_pipeline(tmpdir):
+    '''function running the stage over texts in a separate process
+
+    Call it with the stage config and a list of :class:`unicode`
+    texts; it returns the process's log once it has exited.  As in a
+    real run, the stage is never shut down.
+
+    '''
+    env = dict(os.environ)
+    root = os.path.dirname(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))))
+    env['PYTHONPATH'] = os.pathsep.join(
+        [root] + [p for p in [env.get('PYTHONPATH')] if p])
+
+    def run(config, texts):
+        args = json.dumps([config, texts, str(tmpdir.join('tmp'))])
+        proc = subprocess.Popen([sys.executable, '-c', PIPELINE_SCRIPT, args],
+                                env=env, stderr=subprocess.PIPE)
+        _, log = proc.communicate()
+        assert proc.returncode == 0, log
+        return log.decode('utf8')
+    return run
@@ -0,0 +1,173 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import os
+
+import pytest
+import requests
+from streamcorpus import make_stream_item
+from streamcorpus_pipeline._tokenizer import nltk_tokenizer
+
+from streamcorpus_opensextant.archive import ArchiveReader, ArchiveWriter, \
+    RecordingAdapter, ReplayAdapter, open_writer, request_key
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+from streamcorpus_opensextant.tests.test_tagger import texts, \
+    verify_selectors, verify_sentences
+
+url = 'http://localhost:8182/opensextant/extract/general/json'
+
+
+def fixture_content(json_path):
+    fpath = os.path.join(os.path.dirname(__file__), json_path)
+    with open(fpath, 'rb') as fh:
+        return fh.read()
+
+
+@pytest.fixture
+def archive_path(tmpdir):
+    '''an archive holding the canned responses for `texts`'''
+    path = str(tmpdir.join('responses.osra'))
+    writer = ArchiveWriter(path)
+    for text, _, json_path in texts:
+        writer.put(request_key('POST', url, text.encode('utf8')),
+                   fixture_content(json_path))
+    writer.close()
+    return path
+
+
+@pytest.mark.parametrize('text,tokens,json_path', texts)
+def test_opensextant_tagger_replay(text, tokens, json_path, archive_path):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['annotate_sentences'] = True
+    config['add_geo_selectors'] = True
+    config['archive_mode'] = 'replay'
+    config['archive_path'] = archive_path
+    # replay ignores the host, and nothing listens here
+    config['network_address'] = 'localhost:1'
+    ost = OpenSextantTagger(config)
+
+    si = make_stream_item(10, 'fake_url')
+    si.body.clean_visible = text.encode('utf8')
+    nltk_tokenizer({}).process_item(si)
+    ost.process_item(si)
+    ost.shutdown()
+
+    assert si.body.taggings['opensextant'].raw_tagging == \
+        fixture_content(json_path)
+    verify_sentences(si, tokens)
+    verify_selectors(si)
+
+
+def test_replay_missing(archive_path):
+    reader = ArchiveReader(archive_path)
+    session = requests.Session()
+    session.mount('http://', ReplayAdapter(reader))
+    with pytest.raises(requests.exceptions.ConnectionError):
+        session.post(url, data=b'not in the archive')
+    reader.close()
+
+
+def test_record(archive_path, tmpdir):
+    path = str(tmpdir.join('recorded.osra'))
+    source = ArchiveReader(archive_path)
+    writer = ArchiveWriter(path)
+    session = requests.Session()
+    session.mount('http://', RecordingAdapter(writer, ReplayAdapter(source)))
+    text, _, json_path = texts[0]
+    resp = session.post(url, data=text.encode('utf8'))
+    assert resp.content == fixture_content(json_path)
+    writer.close()
+    source.close()
+
+    reader = ArchiveReader(path)
+    assert len(reader) == 1
+    assert reader.get(request_key('POST', url, text.encode('utf8'))) == \
+        fixture_content(json_path)
+    reader.close()
+
+
+def test_interrupted_recording(tmpdir):
+    path = str(tmpdir.join('interrupted.osra'))
+    writer = ArchiveWriter(path)
+    writer.put(b'a' * 20, b'first')
+    writer.put(b'b' * 20, b'second')
+    # simulate a crash: the records reach the file and the lock is
+    # released, but the index is never written
+    writer._fh.close()
+
+    reader = ArchiveReader(path)
+    assert reader.get(b'b' * 20) == b'second'
+    reader.close()
+
+    # recording again picks up where the interrupted one stopped
+    writer = ArchiveWriter(path)
+    writer.put(b'c' * 20, b'third')
+    writer.close()
+    reader = ArchiveReader(path)
+    assert [reader.get(k * 20) for k in (b'a', b'b', b'c', b'd')] == \
+        [b'first', b'second', b'third', None]
+    reader.close()
+
+
+def test_shared_writer(tmpdir):
+    path = str(tmpdir.join('shared.osra'))
+    first = open_writer(path)
+    assert open_writer(path) is first
+    with pytest.raises(ValueError):
+        ArchiveWriter(path)
+    first.put(b'a' * 20, b'first')
+    first.close()
+    # still open for the second user
+    first.put(b'b' * 20, b'second')
+    first.close()
+    reader = ArchiveReader(path)
+    assert len(reader) == 2
+    reader.close()
+    # the last close released the file
+    ArchiveWriter(path).close()
+
+
+def test_opensextant_tagger_record_shared(standin_server, tmpdir):
+    path = str(tmpdir.join('recorded.osra'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['archive_mode'] = 'record'
+    config['archive_path'] = path
+    taggers = [OpenSextantTagger(config), OpenSextantTagger(config)]
+    texts = [b'Traveling to Paris, Texas.', b'Off to Paris.',
+             b'Snow in Moscow.', b'Rain in London.']
+    for n, text in enumerate(texts):
+        si = make_stream_item(10 + n, 'http://example.com/%d' % n)
+        si.body.clean_visible = text
+        taggers[n % 2].process_item(si)
+    for ost in taggers:
+        ost.shutdown()
+
+    reader = ArchiveReader(path)
+    assert len(reader) == 4
+    for text in texts:
+        assert reader.get(request_key(
+            'POST', '/opensextant/extract/geo/json', text)) is not None
+    reader.close()
+
+
+def test_record_pipeline(standin_server, run_pipeline, tmpdir):
+    path = str(tmpdir.join('recorded.osra'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['archive_mode'] = 'record'
+    config['archive_path'] = path
+    recorded = [u'Traveling to Paris, Texas.', u'Snow in Moscow.']
+    run_pipeline(config, recorded)
+
+    reader = ArchiveReader(path)
+    # the index was written at exit, so opening needed no scan
+    assert reader._entries is None
+    assert len(reader) == 2
+    for text in recorded:
+        assert reader.get(request_key(
+            'POST', '/opensextant/extract/geo/json',
+            text.encode('utf8'))) is not None
+    reader.close()
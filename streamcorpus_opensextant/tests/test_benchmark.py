@@ -0,0 +1,34 @@
+
+from __future__ import absolute_import
+import json
+
+from streamcorpus_opensextant.benchmark import percentile, sweep
+from streamcorpus_opensextant.synthetic import make_corpus
+
+
+def test_percentile():
+    values = list(range(1, 101))
+    assert percentile(values, 50) == 50
+    assert percentile(values, 99) == 99
+    assert percentile(values, 100) == 100
+    assert percentile([7], 95) == 7
+    assert percentile([], 50) is None
+
+
+def test_make_corpus_deterministic():
+    first = [si.body.clean_visible for si in make_corpus('news', 3, seed=1)]
+    again = [si.body.clean_visible for si in make_corpus('news', 3, seed=1)]
+    assert first == again
+    assert all(len(cv) >= 5 * 1024 for cv in first)
+
+
+def test_sweep(standin_server):
+    results = sweep(standin_server.network_address, ['tweet', 'news'], 4,
+                    [1, 2])
+    assert len(results) == 2 * 2 * 3
+    for result in results:
+        assert result['failures'] == 0
+        assert result['docs_per_sec'] > 0
+        assert result['latency_p50_sec'] <= result['latency_p99_sec']
+        assert result['peak_rss_kb'] > 0
+    json.dumps(results)
@@ -0,0 +1,97 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import os
+
+import pytest
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.capture import SlowCapture, archive_captures, \
+    iter_captures, load_capture
+from streamcorpus_opensextant.microbench import load_inputs, run_phases
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def make_si(n, text=b'Traveling to Paris, Texas.'):
+    si = make_stream_item(10 + n, 'http://example.com/%d' % n)
+    si.body.clean_visible = text
+    return si
+
+
+@pytest.mark.parametrize('standin_server', [{'latency': 'fixed:0.05'}],
+                         indirect=True)
+def test_opensextant_tagger_capture(standin_server, tmpdir):
+    spool = str(tmpdir.join('spool'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['capture_dir'] = spool
+    config['capture_request_seconds'] = 0.01
+    ost = OpenSextantTagger(config)
+    si = make_si(0)
+    ost.process_item(si)
+    ost.shutdown()
+
+    path, = list(iter_captures(spool))
+    metadata, clean_visible, response = load_capture(path)
+    assert metadata['stream_id'] == si.stream_id
+    assert metadata['url'] == ost.rest_url
+    assert metadata['timings']['request'] >= 0.05
+    assert clean_visible == si.body.clean_visible
+    assert response == si.body.taggings['opensextant'].raw_tagging
+
+    # captures feed the microbenchmarks...
+    inputs = load_inputs([spool], sizes=[])
+    assert [name for name, _, _ in inputs] == [os.path.basename(path)]
+    assert len(run_phases(inputs, repeat=1)) == 4
+
+    # ...and replay
+    archive = str(tmpdir.join('captured.osra'))
+    assert archive_captures(spool, archive) == 1
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['annotate_sentences'] = False
+    config['archive_mode'] = 'replay'
+    config['archive_path'] = archive
+    ost = OpenSextantTagger(config)
+    replayed = make_si(0)
+    ost.process_item(replayed)
+    ost.shutdown()
+    assert replayed.body.taggings['opensextant'].raw_tagging == response
+
+
+def test_capture_thresholds_and_cap(tmpdir):
+    spool = str(tmpdir.join('spool'))
+    capture = SlowCapture(spool, request_seconds=1, processing_seconds=1,
+                          max_bytes=250)
+    fast = {'request': 0.5, 'total': 0.6}
+    slow = {'request': 0.5, 'total': 2.0}
+    assert not capture.check(make_si(0), fast, b'{}')
+    for n in range(4):
+        assert capture.check(make_si(n), slow, b'{"annoList": []}')
+    names = [os.path.basename(p) for p in iter_captures(spool)]
+    # each capture is a little over 100 bytes, so only the newest fit
+    assert len(names) < 4
+    assert make_si(3).stream_id in names
+    assert capture.bytes <= 250
+
+    # a reopened spool knows its size
+    assert SlowCapture(spool, max_bytes=250).bytes == capture.bytes
+
+
+def test_capture_spool_error(standin_server, tmpdir):
+    spool = str(tmpdir.join('spool'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['capture_dir'] = spool
+    config['capture_request_seconds'] = 0
+    ost = OpenSextantTagger(config)
+    si = make_si(0)
+    # a stray file where the capture directory would go
+    with open(os.path.join(spool, si.stream_id), 'w') as fh:
+        fh.write('in the way')
+    ost.process_item(si)
+    ost.shutdown()
+    assert 'opensextant' in si.body.taggings
+    assert ost.capture.captured == 0
+    assert list(iter_captures(spool)) == []
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+import codecs
+from copy import deepcopy
+
+import pytest
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.gazetteer import Gazetteer, read_tsv, \
+    write_index
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+from streamcorpus_opensextant.tests.test_tagger import verify_selectors
+
+gazetteer_rows = u'''# name\tplaceID\tlat\tlng\tbias
+Paris\tNGA-1456928\t48.86667\t2.33333\t0.5
+Paris\tUSGS1377803\t33.66094\t-95.55551\t0.1
+Texas\tUSGS1779801\t31.25044\t-99.25061\t0.05
+Paris, Texas\tUSGS1377803\t33.66094\t-95.55551\t0.2
+Québec\tNGA-6325494\t46.81228\t-71.21454\t0.3
+New York\tUSGS975772\t42.00027\t-75.50028\t0.4
+'''
+
+
+@pytest.fixture
+def gazetteer_path(tmpdir):
+    tsv = str(tmpdir.join('places.tsv'))
+    with codecs.open(tsv, 'w', encoding='utf-8') as fh:
+        fh.write(gazetteer_rows)
+    path = str(tmpdir.join('places.idx'))
+    write_index(read_tsv(tsv), path)
+    return path
+
+
+def test_gazetteer_find(gazetteer_path):
+    gaz = Gazetteer(gazetteer_path)
+    try:
+        text = u'From paris, texas to Québec via Parisian New York.'
+        found = [(text[start:end], place['placeID'])
+                 for start, end, place in gaz.find(text)]
+    finally:
+        gaz.close()
+    # longest match wins, "Parisian" is not a word-bounded match
+    assert found == [
+        (u'paris, texas', u'USGS1377803'),
+        (u'Québec', u'NGA-6325494'),
+        (u'New York', u'USGS975772'),
+    ]
+
+
+def test_gazetteer_highest_bias(gazetteer_path):
+    gaz = Gazetteer(gazetteer_path)
+    try:
+        results = gaz.extract(u'Paris.')
+    finally:
+        gaz.close()
+    anno, = results['annoList']
+    assert anno['matchText'] == u'Paris'
+    assert (anno['start'], anno['end']) == (0, 5)
+    assert anno['features']['place']['placeID'] == u'NGA-1456928'
+
+
+def test_gazetteer_bad_index(tmpdir):
+    path = str(tmpdir.join('bogus.idx'))
+    with open(path, 'wb') as fh:
+        fh.write(b'\0' * 64)
+    with pytest.raises(ValueError):
+        Gazetteer(path)
+
+
+@pytest.mark.parametrize('mode', ['primary', 'fallback'])
+def test_opensextant_tagger_gazetteer(gazetteer_path, mode):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['annotate_sentences'] = False
+    config['add_geo_selectors'] = True
+    config['gazetteer_path'] = gazetteer_path
+    config['gazetteer_mode'] = mode
+    # nothing listens here, so fallback mode must use the gazetteer
+    config['network_address'] = 'localhost:1'
+    config['retries'] = 1
+    ost = OpenSextantTagger(config)
+
+    si = make_stream_item(10, 'fake_url')
+    si.body.clean_visible = u'Traveling to Paris, Texas.'.encode('utf8')
+    ost.process_item(si)
+    ost.shutdown()
+
+    verify_selectors(si)
+    assert [sel.raw_selector for sel in si.body.selectors['opensextant']] \
+        == [b'Paris, Texas']
+
+
+@pytest.mark.parametrize('standin_server', [{'error_rate': 1.0}],
+                         indirect=True)
+def test_opensextant_tagger_gazetteer_http_error(gazetteer_path,
+                                                 standin_server):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['annotate_sentences'] = False
+    config['gazetteer_path'] = gazetteer_path
+    config['network_address'] = standin_server.network_address
+    ost = OpenSextantTagger(config)
+
+    si = make_stream_item(10, 'fake_url')
+    si.body.clean_visible = u'Traveling to Paris, Texas.'.encode('utf8')
+    ost.process_item(si)
+    ost.shutdown()
+
+    assert standin_server.stats['errors'] == 1
+    assert [sel.raw_selector for sel in si.body.selectors['opensextant']] \
+        == [b'Paris, Texas']
@@ -0,0 +1,131 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import os
+import random
+
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.geoindex import GeoIndex, GeoIndexWriter, \
+    chunk_index_name, decode, encode, haversine_km, merge
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def random_points(n, seed):
+    rng = random.Random(seed)
+    return [('si-%d' % (i % 7), 'pid-%d' % i,
+             rng.uniform(-90, 90), rng.uniform(-180, 180), i, 5)
+            for i in range(n)]
+
+
+def write_points(points, path):
+    writer = GeoIndexWriter(path)
+    for stream_id, place_id, lat, lng, offset, length in points:
+        writer.add(stream_id, place_id, lat, lng, offset, length)
+    return writer.close()
+
+
+def test_encode_decode():
+    for lat, lng in [(0, 0), (48.86667, 2.33333), (-33.86785, 151.20732),
+                     (-90, -180), (90, 180)]:
+        dlat, dlng = decode(encode(lat, lng))
+        assert abs(dlat - lat) < 1e-6 and abs(dlng - lng) < 1e-6
+    # nearby points share a key prefix
+    assert encode(10.0, 10.0) >> 40 == encode(10.0001, 10.0001) >> 40
+
+
+def test_geoindex_queries(tmpdir):
+    points = random_points(2000, 1)
+    path = str(tmpdir.join('points.geoidx'))
+    assert write_points(points, path) == len(points)
+    index = GeoIndex(path)
+    assert len(index) == len(points)
+
+    for box in [(10, 20, 30, 60), (-5, -5, 5, 5), (-90, -180, 90, 180),
+                (40, 170, 60, -170)]:
+        min_lat, min_lng, max_lat, max_lng = box
+        if min_lng <= max_lng:
+            inside = lambda p: min_lng <= p[3] <= max_lng
+        else:
+            inside = lambda p: p[3] >= min_lng or p[3] <= max_lng
+        expected = set(p[1] for p in points
+                       if min_lat <= p[2] <= max_lat and inside(p))
+        assert set(h.place_id for h in index.bbox(*box)) == expected
+
+    for lat, lng, km in [(48.86, 2.35, 1500), (0, 179.5, 800),
+                         (89, 0, 500)]:
+        expected = set(p[1] for p in points
+                       if haversine_km(lat, lng, p[2], p[3]) <= km - 0.01)
+        found = set(h.place_id for h in index.radius(lat, lng, km))
+        assert expected <= found
+        for hit in index.radius(lat, lng, km):
+            assert haversine_km(lat, lng, hit.latitude, hit.longitude) <= km
+    index.close()
+
+
+def test_geoindex_merge(tmpdir):
+    points = random_points(500, 2)
+    paths = []
+    for i in range(3):
+        paths.append(str(tmpdir.join('%d.geoidx' % i)))
+        write_points(points[i::3], paths[-1])
+    out = str(tmpdir.join('merged.geoidx'))
+    assert merge(paths, out) == len(points)
+    index = GeoIndex(out)
+    records = list(index.records())
+    assert [r[0] for r in records] == sorted(r[0] for r in records)
+    assert set(h.place_id for h in index.bbox(-90, -180, 90, 180)) == \
+        set(p[1] for p in points)
+    index.close()
+
+
+def test_opensextant_tagger_geo_index(standin_server, tmpdir):
+    directory = str(tmpdir.join('geoidx'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['geo_index_dir'] = directory
+    ost = OpenSextantTagger(config)
+    chunks = [('/data/2015-01-01/a.sc.xz', [b'Traveling to Paris, Texas.',
+                                            b'Flights from Tokyo.']),
+              ('/data/2015-01-02/a.sc.xz', [b'Snow in Moscow.'])]
+    for chunk, texts in chunks:
+        for n, text in enumerate(texts):
+            si = make_stream_item(10 + n, 'http://example.com/%d' % n)
+            si.body.clean_visible = text
+            ost.process_item(si, {'i_str': chunk})
+    ost.shutdown()
+
+    # the two chunks share a base name but get their own indexes
+    names = [chunk_index_name(chunk) for chunk, _ in chunks]
+    assert names[0] != names[1]
+    assert all(name.startswith('a.sc.xz-') for name in names)
+    assert sorted(os.listdir(directory)) == sorted(names)
+    index = GeoIndex(os.path.join(directory, names[0]))
+    assert len(index) == 3
+    hit, = index.radius(48.86, 2.35, 50)
+    assert hit.place_id == u'NGA-1456928'
+    assert (hit.offset, hit.length) == (13, 5)
+    index.close()
+    index = GeoIndex(os.path.join(directory, names[1]))
+    hit, = index.bbox(50, 30, 60, 40)
+    assert hit.place_id == u'NGA-524901'
+    index.close()
+
+
+def test_geo_index_pipeline(standin_server, run_pipeline, tmpdir):
+    directory = str(tmpdir.join('geoidx'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['geo_index_dir'] = directory
+    run_pipeline(config, [u'Traveling to Paris, Texas.', u'Snow in Moscow.'])
+
+    # written at exit, since the pipeline never calls shutdown()
+    name, = os.listdir(directory)
+    assert name.endswith('.geoidx')
+    index = GeoIndex(os.path.join(directory, name))
+    assert len(index) == 3
+    hit, = index.bbox(50, 30, 60, 40)
+    assert hit.place_id == u'NGA-524901'
+    index.close()
@@ -0,0 +1,104 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import re
+
+import pytest
+from streamcorpus import EntityType, MentionType, Offset, OffsetType, Token
+
+from streamcorpus_opensextant.mentions import resolve_mentions
+from streamcorpus_opensextant.tagger import OpenSextantTagger, mention_types
+
+
+def tokenize(text):
+    return [Token(token=m.group().encode('utf8'), offsets={
+        OffsetType.CHARS: Offset(type=OffsetType.CHARS, first=m.start(),
+                                 length=m.end() - m.start())})
+            for m in re.finditer(r'\S+', text)]
+
+
+def anno(text, match, hierarchy, name_bias=None, start=0):
+    start = text.index(match, start)
+    features = {'hierarchy': hierarchy}
+    if name_bias is not None:
+        features['place'] = {'nameBias': name_bias}
+    return {'start': start, 'end': start + len(match), 'matchText': match,
+            'features': features}
+
+
+def resolve(text, annos, priority):
+    return [(tok.token, mention_id, entity_type)
+            for tok, mention_id, entity_type, _ in resolve_mentions(
+                annos, tokenize(text), mention_types, priority)]
+
+
+text = 'Acme Bank of John Smith in Paris'
+annos = [
+    anno(text, 'John Smith', 'Person.name.personName'),
+    anno(text, 'Acme', 'Information'),
+    anno(text, 'Acme Bank of John Smith', 'Organization'),
+    anno(text, 'Paris', 'Geo.place.namedPlace', 0.05),
+]
+
+
+def test_resolve_longest():
+    assert resolve(text, annos, 'longest') == [
+        ('Acme', 0, EntityType.ORG),
+        ('Bank', 0, EntityType.ORG),
+        ('of', 0, EntityType.ORG),
+        ('John', 0, EntityType.ORG),
+        ('Smith', 0, EntityType.ORG),
+        ('Paris', 1, EntityType.LOC),
+    ]
+
+
+def test_resolve_depth():
+    assert resolve(text, annos, 'depth') == [
+        ('Acme', 0, EntityType.ORG),
+        ('Bank', 0, EntityType.ORG),
+        ('of', 0, EntityType.ORG),
+        ('John', 1, EntityType.PER),
+        ('Smith', 1, EntityType.PER),
+        ('Paris', 2, EntityType.LOC),
+    ]
+
+
+def test_resolve_bias():
+    text = 'New York City'
+    annos = [anno(text, 'New York', 'Geo.place.namedPlace', 0.5),
+             anno(text, 'York', 'Geo.place.namedPlace', 0.9)]
+    assert resolve(text, annos, 'bias') == [
+        ('New', 0, EntityType.LOC),
+        ('York', 1, EntityType.LOC),
+    ]
+    assert resolve(text, annos, 'longest') == [
+        ('New', 0, EntityType.LOC),
+        ('York', 0, EntityType.LOC),
+    ]
+
+
+def test_resolve_many_nested():
+    words = 20000
+    text = ' '.join(['Paris'] * words)
+    # every word is a place, and every tenth word starts a 10-word name
+    annos = [anno(text, 'Paris', 'Geo.place.namedPlace', 0.05, 6 * i)
+             for i in range(words)]
+    annos.extend({'start': 6 * i, 'end': 6 * (i + 10) - 1,
+                  'features': {'hierarchy': 'Person.name.personName'}}
+                 for i in range(0, words, 10))
+    resolved = resolve(text, annos, 'longest')
+    assert len(resolved) == words
+    assert set(entity_type for _, _, entity_type in resolved) == \
+        set([EntityType.PER])
+    assert [mention_id for _, mention_id, _ in resolved[::10]] == \
+        list(range(words // 10))
+    _, _, e_type, m_type = next(resolve_mentions(
+        annos[:1], tokenize(text), mention_types, 'longest'))
+    assert (e_type, m_type) == (EntityType.LOC, MentionType.NAME)
+
+
+def test_mention_priority_config():
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['mention_priority'] = 'loudest'
+    with pytest.raises(ValueError):
+        OpenSextantTagger(config)
@@ -0,0 +1,81 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+
+import pytest
+import requests
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.metrics import Registry
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def test_registry_prometheus_text():
+    registry = Registry()
+    registry.counter('things_total', 'things seen',
+                     {'kind': 'a'}).inc(3)
+    registry.counter('things_total', labels={'kind': 'a'}).inc()
+    hist = registry.histogram('wait_seconds', 'waiting', buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 7):
+        hist.observe(value)
+    assert registry.prometheus_text().splitlines() == [
+        '# HELP things_total things seen',
+        '# TYPE things_total counter',
+        'things_total{kind="a"} 4',
+        '# HELP wait_seconds waiting',
+        '# TYPE wait_seconds histogram',
+        'wait_seconds_bucket{le="0.1"} 1',
+        'wait_seconds_bucket{le="1"} 3',
+        'wait_seconds_bucket{le="+Inf"} 4',
+        'wait_seconds_sum 8.05',
+        'wait_seconds_count 4',
+    ]
+    with pytest.raises(ValueError):
+        registry.histogram('things_total')
+
+
+def test_opensextant_tagger_metrics(standin_server, tmpdir):
+    path = str(tmpdir.join('opensextant.prom'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['metrics_path'] = path
+    ost = OpenSextantTagger(config)
+    for _ in range(3):
+        si = make_stream_item(10, 'fake_url')
+        si.body.clean_visible = b'Traveling to Paris, Texas.'
+        ost.process_item(si)
+    ost.process_item(make_stream_item(10, 'fake_url'))
+
+    snap = ost.metrics.snapshot()
+    assert snap['opensextant_items_total'] == [({}, 4)]
+    assert snap['opensextant_selectors_total'] == [({}, 6)]
+    assert snap['opensextant_annotations_kept_total'] == [({}, 6)]
+    assert snap['opensextant_request_bytes_total'] == \
+        [({'backend': 'geo'}, 3 * len(si.body.clean_visible))]
+    assert snap['opensextant_request_seconds'][0][1]['count'] == 3
+    assert snap['opensextant_item_seconds'][0][1]['count'] == 4
+
+    ost.shutdown()
+    with open(path) as fh:
+        text = fh.read()
+    assert 'opensextant_items_total 4\n' in text
+    assert 'opensextant_request_seconds_count{backend="geo"} 3\n' in text
+
+
+@pytest.mark.parametrize('standin_server', [{'error_rate': 1.0}],
+                         indirect=True)
+def test_opensextant_tagger_failure_metrics(standin_server):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    ost = OpenSextantTagger(config)
+    for _ in range(2):
+        si = make_stream_item(10, 'fake_url')
+        si.body.clean_visible = b'Traveling to Paris, Texas.'
+        with pytest.raises(requests.exceptions.HTTPError):
+            ost.process_item(si)
+
+    snap = ost.metrics.snapshot()
+    assert snap['opensextant_failures_total'] == [({'backend': 'geo'}, 2)]
+    assert snap['opensextant_items_total'] == [({}, 2)]
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import absolute_import
+
+from streamcorpus_opensextant.microbench import load_inputs, phases, \
+    run_phases, tokenize
+
+
+def test_tokenize():
+    text = u'Paris, Texas. Café au lait'
+    sentences = tokenize(text)
+    assert [[tok.token for tok in sent.tokens] for sent in sentences] == \
+        [[b'Paris,', b'Texas.'], [b'Caf\xc3\xa9', b'au', b'lait']]
+    tok = sentences[1].tokens[2]
+    offset = tok.offsets.values()[0]
+    assert text[offset.first:offset.first + offset.length] == u'lait'
+
+
+def test_run_phases():
+    inputs = load_inputs(sizes=[2048])
+    assert [name for name, _, _ in inputs][-1] == 'synthetic-2048'
+    results = run_phases(inputs, repeat=2)
+    assert len(results) == len(inputs) * len(phases)
+    for result in results:
+        assert result['best_sec'] <= result['median_sec']
+        assert result['annotations'] > 0
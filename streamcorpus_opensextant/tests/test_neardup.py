@@ -0,0 +1,103 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import random
+
+import pytest
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.neardup import NearDupIndex, same_annotations
+from streamcorpus_opensextant.standin import places, synthesize_response
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def make_story(seed, sentences=40):
+    rng = random.Random(seed)
+    names = sorted(places)
+    people = [u'Maria Lopez', u'John Smith', u'Ada Okafor', u'Wei Chen']
+    return u' '.join(
+        u'Officials in %s met %s about the %d trade talks with %s.'
+        % (rng.choice(names), rng.choice(people), rng.randint(1990, 2015),
+           rng.choice(names))
+        for _ in range(sentences))
+
+
+def variants(story):
+    sentences = story.split(u'. ')
+    edited = list(sentences)
+    edited[10] = u'Reporters in Lagos asked Wei Chen about the delay'
+    yield u'WIRE SERVICE REPORT\n' + story
+    yield story + u'\nCopyright Example News. Sign up in London today.'
+    yield u'. '.join(edited)
+    yield u'. '.join(sentences[:5] + sentences[6:])
+
+
+def test_neardup_reuse_matches_full_tagging():
+    story = make_story(0)
+    index = NearDupIndex()
+    index.add(story, synthesize_response(story), index.sketch(story))
+    # the echoed text is not held a second time
+    doc, = index._docs.values()
+    assert doc.extra['content'] is None
+    for text in variants(story):
+        reuse = index.find(text, index.sketch(text))
+        assert reuse is not None
+        sent = sum(end - start for start, end in reuse.windows)
+        assert sent < len(text) / 4
+        merged = reuse.merge([synthesize_response(text[start:end])
+                              for start, end in reuse.windows])
+        assert same_annotations(merged, synthesize_response(text))
+        assert merged['content'] == text
+
+
+def test_neardup_unrelated_and_eviction():
+    story = make_story(0)
+    index = NearDupIndex(max_chars=len(story) * 2)
+    assert index.sketch(u'Too short.') is None
+    index.add(story, synthesize_response(story), index.sketch(story))
+    other = make_story(1)
+    assert index.find(other, index.sketch(other)) is None
+    index.add(other, synthesize_response(other), index.sketch(other))
+    third = make_story(2)
+    index.add(third, synthesize_response(third), index.sketch(third))
+    assert len(index) == 2
+    assert index.find(story, index.sketch(story)) is None
+    assert index.find(third, index.sketch(third)) is not None
+
+
+@pytest.mark.parametrize('verify_rate', [0, 1])
+def test_opensextant_tagger_neardup(standin_server, verify_rate):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    plain = OpenSextantTagger(config)
+    config['neardup'] = True
+    config['neardup_verify_rate'] = verify_rate
+    ost = OpenSextantTagger(config)
+
+    story = make_story(0)
+    texts = [story] + list(variants(story))
+    for n, text in enumerate(texts):
+        si = make_stream_item(10 + n, 'http://example.com/%d' % n)
+        si.body.clean_visible = text.encode('utf8')
+        expected = make_stream_item(10 + n, 'http://example.com/%d' % n)
+        expected.body.clean_visible = si.body.clean_visible
+        ost.process_item(si)
+        plain.process_item(expected)
+        assert si.body.selectors['opensextant'] == \
+            expected.body.selectors['opensextant']
+
+    snap = ost.metrics.snapshot()
+    assert snap['opensextant_neardup_reused_total'] == [({}, 4)]
+    assert snap['opensextant_neardup_mismatches_total'] == [({}, 0)]
+    avoided = snap['opensextant_neardup_bytes_avoided_total'][0][1]
+    if verify_rate:
+        # every reused item was also sent in full
+        assert avoided == 0
+    else:
+        assert avoided > 3 * len(story)
+        sent = snap['opensextant_request_bytes_total'][0][1]
+        assert sent + avoided == sum(len(text.encode('utf8'))
+                                     for text in texts)
+    ost.shutdown()
+    plain.shutdown()
@@ -0,0 +1,69 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import os
+import pstats
+
+import pytest
+from streamcorpus import make_stream_item
+
+from streamcorpus_opensextant.profiling import PhaseProfiler
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def test_sample_rate_requires_dir():
+    with pytest.raises(ValueError):
+        PhaseProfiler(sample_rate=0.5)
+
+
+def test_opensextant_tagger_profiling(standin_server, tmpdir):
+    profile_dir = str(tmpdir.join('profiles'))
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['profile_phases'] = True
+    config['profile_sample_rate'] = 1.0
+    config['profile_dir'] = profile_dir
+    ost = OpenSextantTagger(config)
+
+    for i_str, count in (('chunk-a', 2), ('chunk-b', 1)):
+        for n in range(count):
+            si = make_stream_item(10 + n, 'http://example.com/%s' % i_str)
+            si.body.clean_visible = b'Traveling to Paris, Texas.'
+            ost.process_item(si, {'i_str': i_str})
+    ost.shutdown()
+
+    summaries = list(ost.profiler.chunk_summaries)
+    assert [(s['chunk'], s['items']) for s in summaries] == \
+        [('chunk-a', 2), ('chunk-b', 1)]
+    for summary in summaries:
+        assert set(summary['seconds']) == set(
+            ['request', 'json_loads', 'filter', 'geo_selectors', 'total'])
+        assert summary['seconds']['request'] <= summary['seconds']['total']
+    phase_seconds = dict((labels['phase'], value['count']) for labels, value
+                         in ost.metrics.snapshot()['opensextant_phase_seconds'])
+    assert phase_seconds['total'] == 3
+
+    names = sorted(os.listdir(profile_dir))
+    assert len(names) == 3
+    stats = pstats.Stats(os.path.join(profile_dir, names[0]))
+    assert stats.total_calls > 0
+
+
+def test_profile_write_error(tmpdir):
+    profile_dir = str(tmpdir.join('profiles'))
+    profiler = PhaseProfiler(sample_rate=1, pstats_dir=profile_dir)
+    si = make_stream_item(10, 'fake_url')
+    # a directory where the stats file would go
+    os.makedirs(os.path.join(profile_dir, si.stream_id + '.pstats'))
+    assert profiler.profile(lambda si: 'tagged', si) == 'tagged'
+
+
+def test_profiling_pipeline(standin_server, run_pipeline):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = standin_server.network_address
+    config['annotate_sentences'] = False
+    config['profile_phases'] = True
+    log = run_pipeline(config, [u'Off to Paris.', u'Snow in Moscow.'])
+    # logged at exit, since the pipeline never calls shutdown()
+    assert 'opensextant phase times for 2 items' in log
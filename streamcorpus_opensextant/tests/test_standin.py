@@ -0,0 +1,123 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import json
+import threading
+
+import pytest
+import requests
+from streamcorpus import make_stream_item, EntityType
+from streamcorpus_pipeline._tokenizer import nltk_tokenizer
+
+from streamcorpus_opensextant.archive import ArchiveWriter, request_key
+from streamcorpus_opensextant.standin import StandinServer, make_latency, \
+    synthesize_response
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+from streamcorpus_opensextant.tests.test_tagger import verify_selectors
+
+
+def make_tagger(server, **overrides):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = server.network_address
+    config.update(overrides)
+    return OpenSextantTagger(config)
+
+
+def make_si(text):
+    si = make_stream_item(10, 'fake_url')
+    si.body.clean_visible = text.encode('utf8')
+    return si
+
+
+def test_synthesize_response():
+    text = u'Jane Q Doe flew from Paris to Texas.'
+    annos = synthesize_response(text)['annoList']
+    assert [(a['matchText'], a['type']) for a in annos] == [
+        (u'Jane Q Doe', 'Person'),
+        (u'Paris', 'PLACE'),
+        (u'Texas', 'PLACE'),
+    ]
+    for anno in annos:
+        assert text[anno['start']:anno['end']] == anno['matchText']
+    assert len(synthesize_response(text, general=False)['annoList']) == 2
+
+
+def test_make_latency():
+    assert make_latency('fixed:0.25')() == 0.25
+    assert 0.1 <= make_latency('uniform:0.1:0.2')() <= 0.2
+    with pytest.raises(ValueError):
+        make_latency('gaussian:1')
+
+
+def test_standin_endpoint_listing(standin_server):
+    resp = requests.post('http://%s/opensextant/extract/'
+                         % standin_server.network_address)
+    assert 'general' in json.loads(resp.content)
+
+
+def test_opensextant_tagger_standin(standin_server):
+    ost = make_tagger(standin_server, annotate_sentences=True)
+    si = make_si(u'John Smith is traveling in Liberia.')
+    nltk_tokenizer({}).process_item(si)
+    ost.process_item(si)
+    verify_selectors(si)
+    toks = si.body.sentences['opensextant'][0].tokens
+    assert [tok.entity_type for tok in toks] == [
+        EntityType.PER, EntityType.PER, None, None, None, EntityType.LOC]
+
+
+def test_standin_serves_archive(tmpdir):
+    path = str(tmpdir.join('responses.osra'))
+    writer = ArchiveWriter(path)
+    writer.put(request_key('POST', '/opensextant/extract/geo/json',
+                           b'Nowhere.'),
+               json.dumps(synthesize_response(u'Paris')).encode('utf8'))
+    writer.close()
+    server = StandinServer(archive_path=path).start()
+    try:
+        ost = make_tagger(server, annotate_sentences=False)
+        si = make_si(u'Nowhere.')
+        ost.process_item(si)
+    finally:
+        server.stop()
+    assert [sel.raw_selector for sel in si.body.selectors['opensextant']] \
+        == [b'Paris']
+
+
+@pytest.mark.parametrize('standin_server', [{'error_rate': 1.0}],
+                         indirect=True)
+def test_standin_errors(standin_server):
+    ost = make_tagger(standin_server, annotate_sentences=False)
+    with pytest.raises(requests.exceptions.HTTPError):
+        ost.process_item(make_si(u'Paris'))
+    assert standin_server.stats['errors'] == 1
+
+
+@pytest.mark.parametrize('standin_server', [{'timeout_rate': 1.0}],
+                         indirect=True)
+def test_standin_timeouts_retried(standin_server):
+    ost = make_tagger(standin_server, annotate_sentences=False,
+                      timeout=0.2, retries=2)
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        ost.process_item(make_si(u'Paris'))
+    assert standin_server.stats['timeouts'] == 2
+
+
+@pytest.mark.parametrize('standin_server', [
+    {'max_concurrency': 2, 'latency': 'fixed:0.1'},
+], indirect=True)
+def test_standin_max_concurrency(standin_server):
+    def work():
+        ost = make_tagger(standin_server, annotate_sentences=False)
+        for _ in range(3):
+            si = make_si(u'Traveling to Paris, Texas.')
+            ost.process_item(si)
+            verify_selectors(si)
+
+    threads = [threading.Thread(target=work) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert standin_server.stats['served'] == 18
+    assert standin_server.stats['max_active'] == 2
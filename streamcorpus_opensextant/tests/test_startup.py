@@ -0,0 +1,74 @@
+
+from __future__ import absolute_import
+from copy import deepcopy
+import subprocess
+import sys
+import time
+
+import pytest
+from streamcorpus import make_stream_item
+import yakonfig
+
+from streamcorpus_opensextant.startup import process_start_time
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+
+
+def make_config(network_address, **overrides):
+    config = deepcopy(OpenSextantTagger.default_config)
+    config['network_address'] = network_address
+    config['annotate_sentences'] = False
+    config.update(overrides)
+    return config
+
+
+def test_process_start_time():
+    assert process_start_time() <= time.time()
+    assert process_start_time() > time.time() - 24 * 3600
+
+
+def test_health_check(standin_server):
+    OpenSextantTagger(make_config(standin_server.network_address,
+                                  health_check=True))
+    with pytest.raises(yakonfig.ConfigurationError):
+        OpenSextantTagger(make_config('localhost:1', health_check=True))
+
+
+def test_prewarm_connections(standin_server):
+    ost = OpenSextantTagger(make_config(standin_server.network_address,
+                                        prewarm_connections=12))
+    pool = ost._http_adapter.get_connection(ost.rest_url)
+    open_conns = [conn for conn in list(pool.pool.queue)
+                  if conn is not None and conn.sock is not None]
+    assert len(open_conns) == 12
+
+    si = make_stream_item(10, 'fake_url')
+    si.body.clean_visible = b'Traveling to Paris, Texas.'
+    ost.process_item(si)
+    assert standin_server.stats['served'] == 1
+    first_item, = ost.metrics.snapshot()['opensextant_first_item_seconds']
+    assert first_item[1] > 0
+
+
+def test_gazetteer_primary_skips_optional_imports(tmpdir):
+    tsv = tmpdir.join('places.tsv')
+    tsv.write('Paris\tNGA-1456928\t48.86667\t2.33333\t0.5\n')
+    script = '''
+import sys
+from streamcorpus import make_stream_item
+from streamcorpus_opensextant.gazetteer import read_tsv, write_index
+from streamcorpus_opensextant.tagger import OpenSextantTagger
+write_index(read_tsv(%r), %r)
+ost = OpenSextantTagger({'annotate_sentences': False,
+                         'add_geo_selectors': False,
+                         'gazetteer_path': %r,
+                         'gazetteer_mode': 'primary'})
+si = make_stream_item(10, 'fake_url')
+si.body.clean_visible = b'Paris'
+ost.process_item(si)
+assert 'Paris' in si.body.taggings['opensextant'].raw_tagging
+print(' '.join(m for m in ('requests', 'geojson', 'sortedcollection')
+               if m in sys.modules))
+''' % (str(tsv), str(tmpdir.join('places.idx')), str(tmpdir.join('places.idx')))
+    output = subprocess.check_output([sys.executable, '-W', 'ignore', '-c',
+                                      script])
+    assert output.strip() == b''